@@ -3,14 +3,25 @@
 # Python version: 3.5
 
 import os
+import json
+import queue
 import logging
+import hashlib
+import tempfile
+import threading
 import pandas as pd
 from math import ceil, pi, exp, log, sqrt
 from pyproj import Proj
 import numpy as np
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
 
 logging.basicConfig(format='%(asctime)s\t\t%(message)s', level=logging.DEBUG)
+logging.getLogger('numba').setLevel(logging.WARNING)  # otherwise the compiler debug output floods the log
 
 # general
 LHV_DIESEL = 9.9445485  # (kWh/l) lower heating value
@@ -51,9 +62,11 @@ SET_GRID_PENALTY = 'GridPenalty'
 SET_URBAN = 'IsUrban'  # Whether the site is urban (0 or 1)
 SET_ENERGY_PER_HH = 'EnergyPerHH'
 SET_NUM_PEOPLE_PER_HH = 'NumPeoplePerHH'
+SET_ENERGY_PER_PERSON = 'EnergyPerPerson'  # Optional demand layer in kWh/person/year (the tier demand where not given)
 SET_ELEC_CURRENT = 'ElecStart'  # If the site is currently electrified (0 or 1)
 SET_ELEC_FUTURE = 'ElecFuture'  # If the site has the potential to be 'easily' electrified in future
 SET_NEW_CONNECTIONS = 'NewConnections'  # Number of new people with electricity connections
+SET_GRID_PRICE = 'GridPrice'  # Optional regional grid price in USD/kWh (the country-wide price where not given)
 SET_MIN_GRID_DIST = 'MinGridDist'
 SET_LCOE_GRID = 'Grid'  # All lcoes in USD/kWh
 SET_LCOE_SA_PV = 'SA_PV'
@@ -70,6 +83,90 @@ SET_MIN_OVERALL_CODE = 'MinimumOverallCode'  # And a code from 1 - 7 to represen
 SET_MIN_CATEGORY = 'MinimumCategory'  # The category with minimum lcoe (grid, minigrid or standalone)
 SET_NEW_CAPACITY = 'NewCapacity'  # Capacity in kW
 SET_INVESTMENT_COST = 'InvestmentCost'  # The investment cost in USD
+SET_SENS_DIESEL_PRICE = 'SensDieselPrice'  # Derivative of the minimum overall LCOE, USD/kWh per USD/litre
+SET_SENS_CAPITAL_COST = 'SensCapitalCost'  # Same, per USD/kW capital cost of the chosen technology
+SET_SENS_DISCOUNT_RATE = 'SensDiscountRate'  # Same, per unit of discount rate (0 - 1)
+SET_SENS_GRID_PRICE = 'SensGridPrice'  # Same, per USD/kWh grid price
+SET_SENS_ENERGY_PER_HH = 'SensEnergyPerHH'  # Same, per kWh/hh/year
+SET_BREAK_EVEN_DIESEL_PRICE = 'BreakEvenDieselPrice'  # Diesel price in USD/litre at which the minimum overall changes
+SET_BREAK_EVEN_DIESEL_TECH = 'BreakEvenDieselTech'  # The technology it changes to at that price
+SET_BREAK_EVEN_GRID_PRICE = 'BreakEvenGridPrice'  # Same for the grid price in USD/kWh
+SET_BREAK_EVEN_GRID_TECH = 'BreakEvenGridTech'
+
+# The columns of a prepped settlements file that running a scenario reads (the others are only used when prepping),
+# with the optional input layers, which are read where the file has them
+SCENARIO_COLUMNS = [SET_COUNTRY, SET_X, SET_Y, SET_X_DEG, SET_Y_DEG, SET_POP_FUTURE, SET_URBAN, SET_ELEC_CURRENT,
+                    SET_NEW_CONNECTIONS, SET_GRID_DIST_PLANNED, SET_GRID_PENALTY, SET_TRAVEL_HOURS, SET_GHI,
+                    SET_WINDCF, SET_SOLAR_RESTRICTION, SET_HYDRO, SET_HYDRO_DIST, SET_HYDRO_FID,
+                    SET_GRID_PRICE, SET_ENERGY_PER_PERSON]
+
+# The dtype of a settlements file column, what happens to nulls (and values that aren't numbers) in it, 'zero' or
+# 'keep' (for the names and the optional layers, where a null means not given, which condition_df used to fill with
+# zero as well), its unit, and the smaller dtype it has in compact mode
+SettlementColumn = namedtuple('SettlementColumn', ['dtype', 'nulls', 'unit', 'compact'])
+
+# The input columns of the settlements files, the columns added when prepping and the results columns, used when
+# reading them, in condition_df and in compact mode (any other columns are read as they are, and the technology LCOE
+# columns have the lcoe_dtype of the SettlementProcessor)
+SETTLEMENT_SCHEMA = {
+    SET_COUNTRY: SettlementColumn('object', 'keep', None, 'category'),
+    SET_X: SettlementColumn('float64', 'zero', 'km', 'float64'),  # kept for the distances between settlements
+    SET_Y: SettlementColumn('float64', 'zero', 'km', 'float64'),
+    SET_POP: SettlementColumn('float64', 'zero', 'people', 'float32'),
+    SET_GRID_DIST_CURRENT: SettlementColumn('float64', 'zero', 'km', 'float32'),
+    SET_GRID_DIST_PLANNED: SettlementColumn('float64', 'zero', 'km', 'float32'),
+    SET_ROAD_DIST: SettlementColumn('float64', 'zero', 'km', 'float32'),
+    SET_NIGHT_LIGHTS: SettlementColumn('float64', 'zero', None, 'float32'),
+    SET_TRAVEL_HOURS: SettlementColumn('float64', 'zero', 'hours', 'float32'),
+    SET_GHI: SettlementColumn('float64', 'zero', 'kWh/m2/year', 'float32'),
+    SET_WINDVEL: SettlementColumn('float64', 'zero', 'm/s', 'float32'),
+    SET_HYDRO: SettlementColumn('float64', 'zero', 'kW', 'float32'),
+    SET_HYDRO_DIST: SettlementColumn('float64', 'zero', 'km', 'float32'),
+    SET_HYDRO_FID: SettlementColumn('int64', 'zero', None, 'int32'),
+    SET_SUBSTATION_DIST: SettlementColumn('float64', 'zero', 'km', 'float32'),
+    SET_ELEVATION: SettlementColumn('float64', 'zero', 'm', 'float32'),
+    SET_SLOPE: SettlementColumn('float64', 'zero', 'degrees', 'float32'),
+    SET_LAND_COVER: SettlementColumn('int64', 'zero', None, 'int8'),
+    SET_SOLAR_RESTRICTION: SettlementColumn('int64', 'zero', None, 'int8'),
+    SET_X_DEG: SettlementColumn('float64', 'zero', 'degrees', 'float32'),
+    SET_Y_DEG: SettlementColumn('float64', 'zero', 'degrees', 'float32'),
+    SET_ROAD_DIST_CLASSIFIED: SettlementColumn('int64', 'zero', None, 'int8'),
+    SET_SUBSTATION_DIST_CLASSIFIED: SettlementColumn('int64', 'zero', None, 'int8'),
+    SET_LAND_COVER_CLASSIFIED: SettlementColumn('int64', 'zero', None, 'int8'),
+    SET_ELEVATION_CLASSIFIED: SettlementColumn('int64', 'zero', None, 'int8'),
+    SET_SLOPE_CLASSIFIED: SettlementColumn('int64', 'zero', None, 'int8'),
+    SET_COMBINED_CLASSIFICATION: SettlementColumn('float64', 'zero', None, 'float32'),
+    SET_GRID_PENALTY: SettlementColumn('float64', 'zero', None, 'float32'),
+    SET_WINDCF: SettlementColumn('float64', 'zero', None, 'float32'),
+    SET_POP_CALIB: SettlementColumn('float64', 'zero', 'people', 'float32'),
+    SET_URBAN: SettlementColumn('int64', 'zero', None, 'int8'),
+    SET_POP_FUTURE: SettlementColumn('float64', 'zero', 'people', 'float32'),
+    SET_ELEC_CURRENT: SettlementColumn('int64', 'zero', None, 'int8'),
+    SET_NEW_CONNECTIONS: SettlementColumn('float64', 'zero', 'people', 'float32'),
+    SET_GRID_PRICE: SettlementColumn('float64', 'keep', 'USD/kWh', 'float32'),
+    SET_ENERGY_PER_PERSON: SettlementColumn('float64', 'keep', 'kWh/person/year', 'float32'),
+    SET_ENERGY_PER_HH: SettlementColumn('float64', 'keep', 'kWh/hh/year', 'float32'),
+    SET_NUM_PEOPLE_PER_HH: SettlementColumn('float64', 'keep', 'people', 'float32'),
+    SET_MIN_OFFGRID: SettlementColumn('object', 'keep', None, 'category'),
+    SET_MIN_OFFGRID_LCOE: SettlementColumn('float64', 'keep', 'USD/kWh', 'float32'),
+    SET_ELEC_FUTURE: SettlementColumn('int64', 'keep', None, 'int8'),
+    SET_MIN_GRID_DIST: SettlementColumn('float64', 'keep', 'km', 'float32'),
+    SET_MIN_OVERALL: SettlementColumn('object', 'keep', None, 'category'),
+    SET_MIN_OVERALL_LCOE: SettlementColumn('float64', 'keep', 'USD/kWh', 'float32'),
+    SET_MIN_OVERALL_CODE: SettlementColumn('float64', 'keep', None, 'int8'),
+    SET_MIN_CATEGORY: SettlementColumn('object', 'keep', None, 'category'),
+    SET_NEW_CAPACITY: SettlementColumn('float64', 'keep', 'kW', 'float32'),
+    SET_INVESTMENT_COST: SettlementColumn('float64', 'keep', 'USD', 'float32'),
+    SET_SENS_DIESEL_PRICE: SettlementColumn('float64', 'keep', None, 'float32'),
+    SET_SENS_CAPITAL_COST: SettlementColumn('float64', 'keep', None, 'float32'),
+    SET_SENS_DISCOUNT_RATE: SettlementColumn('float64', 'keep', None, 'float32'),
+    SET_SENS_GRID_PRICE: SettlementColumn('float64', 'keep', None, 'float32'),
+    SET_SENS_ENERGY_PER_HH: SettlementColumn('float64', 'keep', None, 'float32'),
+    SET_BREAK_EVEN_DIESEL_PRICE: SettlementColumn('float64', 'keep', 'USD/litre', 'float32'),
+    SET_BREAK_EVEN_DIESEL_TECH: SettlementColumn('object', 'keep', None, 'category'),
+    SET_BREAK_EVEN_GRID_PRICE: SettlementColumn('float64', 'keep', 'USD/kWh', 'float32'),
+    SET_BREAK_EVEN_GRID_TECH: SettlementColumn('object', 'keep', None, 'category'),
+}
 
 # Columns in the specs file must match these exactly
 SPE_COUNTRY = 'Country'
@@ -99,6 +196,1181 @@ SPE_MAX_ROAD_DIST = 'MaxRoadDist'
 SPE_POP_CUTOFF1 = 'PopCutOffRoundOne'
 SPE_POP_CUTOFF2 = 'PopCutOffRoundTwo'
 
+# The full result of an LCOE calculation for a number of settlements, each field is an array (one value per settlement)
+# lcoe in USD/kWh, investment_cost (discounted) in USD, installed_capacity and peak_load in kW, td_length in km
+LcoeResult = namedtuple('LcoeResult', ['lcoe', 'investment_cost', 'installed_capacity', 'peak_load', 'td_length'])
+
+# The partial derivatives of the LCOE (USD/kWh) for a number of settlements, each field is an array with the
+# derivative per settlement with respect to: the diesel price (USD/litre), the technology's capital cost (USD/kW), the
+# discount rate, the grid price (USD/kWh) and the energy per household (kWh/year)
+LcoeSensitivities = namedtuple('LcoeSensitivities', ['diesel_price', 'capital_cost', 'discount_rate', 'grid_price',
+                                                     'energy_per_hh'])
+
+# The relative steps that the LCOE inputs varying by settlement are rounded to when deduplicating (see
+# SettlementProcessor), so that settlements share input combinations. Steps of 0.1% change the LCOEs by about 0.1%
+DEDUP_QUANTIZATION = {'energy_per_hh': 0.001, 'people': 0.001, 'capacity_factor': 0.001, 'travel_hours': 0.001,
+                      'mv_line_length': 0.001, 'additional_mv_line_length': 0.001}
+
+# The grid LCOEs from Technology.get_grid_table, lcoes is a (people x distances) array for the population values in
+# people (rounded as in GridLcoeTable.round_people) and the additional MV line lengths in km in distances, calculated
+# with the grid price in grid_price (USD/kWh)
+GridTable = namedtuple('GridTable', ['lcoes', 'people', 'distances', 'grid_price'])
+
+# The cost and network parameters that are shared by all technologies in a scenario (see Technology.default_config)
+TechnologyConfig = namedtuple('TechnologyConfig', ['start_year', 'end_year', 'discount_rate', 'grid_cell_area',
+                                                   'mv_line_cost', 'lv_line_cost', 'mv_line_capacity',
+                                                   'lv_line_capacity', 'lv_line_max_length', 'hv_line_cost',
+                                                   'mv_line_max_length', 'hv_lv_transformer_cost',
+                                                   'mv_increase_rate'])
+
+# An electricity access technology as used by SettlementProcessor:
+# name - the LCOE column name for the technology
+# code - the code used in SET_MIN_OVERALL_CODE
+# category - Grid, MG (mini-grid) or SA (stand-alone), only the Grid category gets its LCOE from the grid extension
+# eligible - function(df, calc) returning the settlements where the technology is an option (None for all)
+# capacity_factor - function(df) returning the capacity factor per settlement (None to use the Technology's own)
+# inputs - function(df) returning any other keyword arguments for Technology.get_lcoe_result (None for none)
+TechnologySpec = namedtuple('TechnologySpec', ['name', 'code', 'category', 'eligible', 'capacity_factor', 'inputs'])
+
+
+def hydro_eligible(df, calc):
+    """
+    Hydropower is an option within 5 km of a site, as long as the site has capacity left. Each site (shared by all
+    settlements with the same FID) is assigned capacity in the order of the settlements.
+    """
+
+    max_hydro_dist = 5  # the max distance in km to consider hydropower viable
+
+    near_hydro = df[SET_HYDRO_DIST] < max_hydro_dist
+    additional_capacity = ((df[SET_NEW_CONNECTIONS] * df[SET_ENERGY_PER_HH] / df[SET_NUM_PEOPLE_PER_HH]) /
+                           (HOURS_PER_YEAR * calc.capacity_factor * calc.base_to_peak_load_ratio)).where(near_hydro, 0)
+    hydro_used = additional_capacity.groupby(df[SET_HYDRO_FID]).cumsum()
+    hydro_available = df.groupby(SET_HYDRO_FID)[SET_HYDRO].transform('first')
+
+    hydro_total_used = additional_capacity.groupby(df[SET_HYDRO_FID]).sum()
+    num_hydro_limited = (hydro_total_used > df.groupby(SET_HYDRO_FID)[SET_HYDRO].first()).sum()
+    logging.info('{} potential hydropower sites were utilised to maximum capacity'.format(num_hydro_limited))
+
+    return near_hydro & (hydro_used <= hydro_available)
+
+
+# The registered technologies, in the order of the columns of SettlementProcessor.lcoes. The grid must come first, and
+# the order decides ties (the first technology wins).
+TECHNOLOGIES = [
+    TechnologySpec(SET_LCOE_GRID, 1, 'Grid', None, None,
+                   lambda df: {'additional_mv_line_length': df[SET_MIN_GRID_DIST]}),
+    TechnologySpec(SET_LCOE_SA_DIESEL, 2, 'SA', None, None,
+                   lambda df: {'travel_hours': df[SET_TRAVEL_HOURS]}),
+    TechnologySpec(SET_LCOE_SA_PV, 3, 'SA',
+                   lambda df, calc: df[SET_GHI] > 1000,
+                   lambda df: df[SET_GHI] / HOURS_PER_YEAR, None),
+    TechnologySpec(SET_LCOE_MG_WIND, 6, 'MG',
+                   lambda df, calc: df[SET_WINDCF] > 0.1,
+                   lambda df: df[SET_WINDCF], None),
+    TechnologySpec(SET_LCOE_MG_DIESEL, 4, 'MG', None, None,
+                   lambda df: {'travel_hours': df[SET_TRAVEL_HOURS]}),
+    TechnologySpec(SET_LCOE_MG_PV, 5, 'MG',
+                   lambda df, calc: (df[SET_SOLAR_RESTRICTION] == 1) & (df[SET_GHI] > 1000),
+                   lambda df: df[SET_GHI] / HOURS_PER_YEAR, None),
+    TechnologySpec(SET_LCOE_MG_HYDRO, 7, 'MG', hydro_eligible, None,
+                   lambda df: {'mv_line_length': df[SET_HYDRO_DIST]}),
+]
+
+
+def register_technology(spec):
+    """
+    Adds a new technology (a TechnologySpec) to the registry, so that it is included in the LCOE calculations,
+    results and summaries. Its Technology is then passed by name to calculate_off_grid_lcoes and results_columns.
+    """
+
+    if spec.name in [tech.name for tech in TECHNOLOGIES]:
+        raise ValueError('A technology called {} is already registered'.format(spec.name))
+    TECHNOLOGIES.append(spec)
+
+
+def read_settlements(path, columns=None, compact=False):
+    """
+    Reads a settlements file by its extension: Parquet (.parquet), Feather (.feather), a SettlementStore directory
+    (.store) or otherwise CSV. The columnar formats keep the dtypes exactly as written and are much faster for large
+    countries, and a store is memory-mapped rather than loaded. With columns, only those of them that are in the file
+    are read.
+
+    CSV files are parsed with the dtypes of SETTLEMENT_SCHEMA by the multithreaded Arrow CSV reader where pyarrow is
+    installed, with integer columns parsed as floats (as they are often written as e.g. 3.0) and cast by
+    apply_settlement_schema. Files with values that aren't numbers in numeric columns are read without the dtypes (or
+    by pandas without pyarrow) and coerced afterwards. Either way apply_settlement_schema is applied.
+
+    With compact, the columns get their compact dtypes (see apply_settlement_schema), with CSV floats parsed straight
+    into them.
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == '.parquet':
+        if columns is not None:
+            columns = [name for name in read_settlement_columns(path) if name in set(columns)]
+        return apply_settlement_schema(pd.read_parquet(path, columns=columns), compact)
+
+    if extension == '.feather':
+        if columns is not None:
+            columns = [name for name in read_settlement_columns(path) if name in set(columns)]
+        return apply_settlement_schema(pd.read_feather(path, columns=columns), compact)
+
+    if extension == '.store':
+        return apply_settlement_schema(SettlementStore(path).read(columns), compact)
+
+    names = read_settlement_columns(path)
+    if columns is not None:
+        names = [name for name in names if name in set(columns)]
+
+    try:
+        import pyarrow
+        import pyarrow.csv
+    except ImportError:
+        return apply_settlement_schema(pd.read_csv(path, usecols=names), compact)
+
+    types = {'float64': pyarrow.float64(), 'float32': pyarrow.float32(), 'int64': pyarrow.float64(),
+             'int32': pyarrow.float64(), 'int8': pyarrow.float64(), 'object': pyarrow.string(),
+             'category': pyarrow.string()}
+    column_types = {name: types[SETTLEMENT_SCHEMA[name].compact if compact else SETTLEMENT_SCHEMA[name].dtype]
+                    for name in names if name in SETTLEMENT_SCHEMA}
+    try:
+        table = pyarrow.csv.read_csv(path, convert_options=pyarrow.csv.ConvertOptions(
+            column_types=column_types, include_columns=names, strings_can_be_null=True))
+    except pyarrow.ArrowInvalid:
+        logging.info('Values that do not fit the schema dtypes in {}, reading it without them'.format(path))
+        table = pyarrow.csv.read_csv(path, convert_options=pyarrow.csv.ConvertOptions(
+            include_columns=names, strings_can_be_null=True))
+    return apply_settlement_schema(table.to_pandas(), compact)
+
+
+def read_settlement_columns(path):
+    """
+    The column names of a settlements file (by its extension, as read_settlements), without reading the settlements.
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == '.parquet':
+        import pyarrow.parquet
+        return pyarrow.parquet.read_schema(path).names
+
+    if extension == '.feather':
+        import pyarrow.ipc
+        with pyarrow.memory_map(path) as source:
+            return pyarrow.ipc.open_file(source).schema.names
+
+    if extension == '.store':
+        return [entry['name'] for entry in SettlementStore(path).load_manifest()['columns']]
+
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+
+def apply_settlement_schema(df, compact=False):
+    """
+    Coerces the columns of a settlements df that are in SETTLEMENT_SCHEMA to their dtype, with values that aren't
+    numbers becoming nulls, and applies their null policy. Columns that already have the dtype and no nulls are left
+    as they are, so this is cheap for files read with the schema. Integer columns with values that aren't whole
+    numbers are kept as float64 (with a warning) rather than truncated.
+
+    With compact, the columns get the compact dtype of their SettlementColumn instead: float32 for continuous values
+    (but the coordinates), int8 (int32 for ids) for flags, classes and codes, and categorical for names. This about
+    halves the memory of the df, and changes values by at most the float32 rounding (a relative 6e-8). Integer columns
+    with values outside the range of the compact dtype keep their full dtype.
+    """
+
+    for column in df.columns:
+        spec = SETTLEMENT_SCHEMA.get(column)
+        if spec is None:
+            continue
+        dtype = spec.compact if compact else spec.dtype
+
+        values = df[column]
+        if spec.dtype == 'object':
+            if dtype == 'category' and not isinstance(values.dtype, pd.CategoricalDtype):
+                df[column] = values.astype('category')
+            continue
+
+        if not pd.api.types.is_numeric_dtype(values):
+            values = pd.to_numeric(values, errors='coerce')
+        if spec.nulls == 'zero' and values.hasnans:
+            values = values.fillna(0)
+        if np.dtype(dtype).kind == 'i' and values.dtype.kind == 'f' and ((values % 1 != 0) & values.notna()).any():
+            logging.warning('{} has values that are not whole numbers, kept as floats'.format(column))
+            dtype = 'float64'
+        if np.dtype(dtype).kind == 'i' and len(values) and \
+                (values.min() < np.iinfo(dtype).min or values.max() > np.iinfo(dtype).max):
+            dtype = spec.dtype
+        if values.dtype != dtype and (not values.hasnans or np.dtype(dtype).kind == 'f'):
+            values = values.astype(dtype)
+        if values is not df[column]:
+            df[column] = values
+
+    return df
+
+
+def write_settlements(df, path, base=None):
+    """
+    Writes a settlements file in the format of its extension, as read_settlements.
+
+    base is optionally the path the settlements were read from. The columns of base that df doesn't have (e.g. those
+    not read for a scenario run, see SCENARIO_COLUMNS) are then written too, in the order of base followed by the
+    other columns of df, so that the output has all columns as if the whole file had been read. Where both are a
+    SettlementStore, the columns of base that df doesn't have or hasn't changed are shared rather than written.
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+    base_store = base if base is not None and os.path.splitext(base)[1].lower() == '.store' else None
+
+    if base is not None and not (extension == '.store' and base_store is not None):
+        df = add_base_columns(df, base)
+
+    if extension == '.parquet':
+        df.to_parquet(path, index=False)
+    elif extension == '.feather':
+        df.reset_index(drop=True).to_feather(path)
+    elif extension == '.store':
+        SettlementStore(path).write(df, base_store)
+    else:
+        df.to_csv(path, index=False)
+
+
+def add_base_columns(df, base):
+    """
+    Returns df with the columns of the settlements file base that it doesn't have read from base, and the columns in
+    the order of base followed by the other columns of df. The rows of df must be those of base, in the same order.
+    """
+
+    names = read_settlement_columns(base)
+    columns = names + [column for column in df.columns if column not in set(names)]
+    missing = [name for name in names if name not in df]
+    if not missing:
+        return df[columns]
+
+    added = read_settlements(base, missing)
+    if len(added) != len(df):
+        raise ValueError('{} has {} settlements, not {} as the settlements written'.format(base, len(added), len(df)))
+    added.index = df.index
+    return pd.concat([df, added], axis=1)[columns]
+
+
+class SettlementStore:
+    """
+    A settlements dataset kept as a directory (named <name>.store) of one .npy file per column, with a manifest.json
+    listing the columns, their files, dtypes and the hashes of their values, and the number of rows. Columns are
+    memory-mapped (copy-on-write) when read, so only the parts of them that a step touches are loaded, and changes to
+    the df never reach the files. Text columns (the country and technology names) are kept as integer codes, with
+    their values in the manifest.
+
+    Writing only adds files for the columns that are new or changed, so the results of a scenario don't rewrite the
+    inputs. A store can also take its unchanged columns from a base store (e.g. the scenario results from the prepped
+    country), with the manifest pointing to the files of the base. The base then records the store as a dependent, and
+    keeps the files its dependents use when it is rewritten (e.g. when the country is prepped again).
+    """
+
+    version = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_manifest_path(self):
+        return os.path.join(self.directory, 'manifest.json')
+
+    def get_dependents_directory(self):
+        return os.path.join(self.directory, 'dependents')
+
+    def load_manifest(self):
+        with open(self.get_manifest_path()) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != self.version:
+            raise ValueError('{} is a settlement store of another version'.format(self.directory))
+        return manifest
+
+    def exists(self):
+        return os.path.exists(self.get_manifest_path())
+
+    def load_column(self, entry, mmap_mode='c'):
+        values = np.load(os.path.join(self.directory, entry['file']), mmap_mode=mmap_mode)
+        if 'categories' in entry:
+            values = pd.Categorical.from_codes(values, entry['categories'])
+            if entry['dtype'] == 'object':
+                values = np.asarray(values, dtype=object)
+        return values
+
+    def read(self, columns=None):
+        """
+        Returns the store as a df (of the columns in it that are in columns, if given) backed by the memory-mapped
+        files.
+        """
+
+        manifest = self.load_manifest()
+        entries = manifest['columns']
+        if columns is not None:
+            columns = set(columns)
+            entries = [entry for entry in entries if entry['name'] in columns]
+        return pd.DataFrame({entry['name']: self.load_column(entry) for entry in entries},
+                            index=pd.RangeIndex(manifest['rows']), copy=False)
+
+    @staticmethod
+    def encode(values):
+        """
+        The array to write for a column, and its manifest entry without the file, with the hash of the array.
+        """
+
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            array, encoded = np.asarray(values.cat.codes), {'dtype': 'category',
+                                                            'categories': values.cat.categories.tolist()}
+        elif values.dtype == object or isinstance(values.dtype, pd.StringDtype):
+            codes, categories = pd.factorize(values)
+            array, encoded = codes.astype(np.int32), {'dtype': 'object', 'categories': categories.tolist()}
+        else:
+            array, encoded = np.ascontiguousarray(values.to_numpy()), {'dtype': str(values.dtype)}
+        encoded['hash'] = hashlib.blake2b(np.ascontiguousarray(array).view(np.uint8), digest_size=16).hexdigest()
+        return array, encoded
+
+    @staticmethod
+    def is_unchanged(entry, encoded, rows):
+        """
+        Whether the column of entry holds the values encoded, by the hash recorded when its file was written (entries
+        of stores written without hashes are always taken as changed).
+        """
+
+        return entry.get('rows', rows) == rows and entry['dtype'] == encoded['dtype'] and \
+            entry.get('categories') == encoded.get('categories') and entry.get('hash') == encoded['hash']
+
+    def add_dependent(self, directory):
+        """
+        Records that the manifest of the store in directory points to files of this store, so that writing this store
+        keeps them.
+        """
+
+        dependents = self.get_dependents_directory()
+        os.makedirs(dependents, exist_ok=True)
+        key = hashlib.sha1(os.path.normcase(os.path.abspath(directory)).encode()).hexdigest()
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=dependents)
+        with os.fdopen(handle, 'w') as f:
+            json.dump({'path': os.path.relpath(directory, self.directory)}, f)
+        os.replace(temp_path, os.path.join(dependents, '{}.json'.format(key)))
+
+    def get_dependent_files(self):
+        """
+        The files of this store that the manifests of its dependents point to. Dependents that were removed or whose
+        manifest no longer points to any are forgotten (those without a manifest yet, being written, are kept).
+        """
+
+        dependents = self.get_dependents_directory()
+        if not os.path.isdir(dependents):
+            return set()
+
+        own = os.path.normcase(os.path.abspath(self.directory))
+        files = set()
+        for name in os.listdir(dependents):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(dependents, name)) as f:
+                dependent = SettlementStore(os.path.join(self.directory, json.load(f)['path']))
+            try:
+                entries = dependent.load_manifest()['columns']
+            except FileNotFoundError:
+                entries = [] if not os.path.isdir(dependent.directory) else None
+            except ValueError:
+                entries = None
+            if entries is None:
+                continue
+
+            used = set()
+            for entry in entries:
+                path = os.path.abspath(os.path.join(dependent.directory, entry['file']))
+                if os.path.normcase(os.path.dirname(path)) == own:
+                    used.add(os.path.basename(path))
+            if used:
+                files |= used
+            else:
+                try:
+                    os.remove(os.path.join(dependents, name))
+                except OSError:
+                    pass
+        return files
+
+    def write(self, df, base=None):
+        """
+        Writes the columns of df, through temporary files and under new names (so that dfs reading the old files,
+        even of the same store, are unaffected), skipping the columns that are unchanged in this store or in the base
+        store, if given. A column is unchanged if the hash of its values is the one in the manifest, so the files
+        already written are never read. The columns of the base that df doesn't have are kept, in the order of the
+        base followed by the other columns of df.
+
+        Every other store that the new manifest points to records this one as a dependent. Files of this store that
+        neither its manifest nor those of its dependents point to are then removed where possible.
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+        rows = len(df)
+        columns = list(df.columns)
+
+        generation = 0
+        candidates = []
+        if self.exists():
+            manifest = self.load_manifest()
+            generation = manifest['generation'] + 1
+            candidates.append({entry['name']: dict(entry, rows=manifest['rows']) for entry in manifest['columns']})
+        if base is not None:
+            base_store = SettlementStore(base)
+            base_manifest = base_store.load_manifest()
+            relative = os.path.relpath(base_store.directory, self.directory)
+            candidates.append({entry['name']: dict(entry, file=os.path.join(relative, entry['file']),
+                                                   rows=base_manifest['rows'])
+                               for entry in base_manifest['columns']})
+
+            names = [entry['name'] for entry in base_manifest['columns']]
+            if base_manifest['rows'] != rows and any(name not in df for name in names):
+                raise ValueError('{} has {} settlements, not {} as the settlements written'.format(
+                    base, base_manifest['rows'], rows))
+            columns = names + [column for column in columns if column not in set(names)]
+
+        entries = []
+        written = 0
+        for i, column in enumerate(columns):
+            if column not in df:
+                entry = dict(candidates[-1][column])
+                del entry['rows']
+                entries.append(entry)
+                continue
+            array, encoded = self.encode(df[column])
+            for entries_by_name in candidates:
+                entry = entries_by_name.get(column)
+                if entry is not None and self.is_unchanged(entry, encoded, rows):
+                    entry = dict(entry)
+                    del entry['rows']
+                    break
+            else:
+                entry = dict(encoded, name=column, file='{}.{}.npy'.format(i, generation))
+                handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+                with os.fdopen(handle, 'wb') as f:
+                    np.save(f, array)
+                os.replace(temp_path, os.path.join(self.directory, entry['file']))
+                written += 1
+            entries.append(dict(entry, name=column))
+
+        # Before the manifest, so that the other stores never remove files it points to
+        own = os.path.normcase(os.path.abspath(self.directory))
+        others = {os.path.normpath(os.path.join(self.directory, os.path.dirname(entry['file']))) for entry in entries}
+        for directory in others:
+            if os.path.normcase(os.path.abspath(directory)) != own:
+                SettlementStore(directory).add_dependent(self.directory)
+
+        manifest = {'version': self.version, 'generation': generation, 'rows': rows, 'columns': entries,
+                    'base': None if base is None else os.path.relpath(base, self.directory)}
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(handle, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(temp_path, self.get_manifest_path())
+        logging.info('Wrote {} of {} columns to {}'.format(written, len(entries), self.directory))
+
+        used = {entry['file'] for entry in entries} | self.get_dependent_files()
+        for name in os.listdir(self.directory):
+            if name.endswith('.npy') and name not in used:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass  # still mapped by a df (on Windows), left for the next write
+
+
+def prefetch(load, items, depth=1):
+    """
+    Yields (item, load(item)) for each of items, loading them in a background thread up to depth items ahead of the
+    one being used (e.g. reading the next country's settlements while one runs). At most depth + 2 loaded items are
+    held at once: those waiting, the one being loaded and the one being used. An exception in load is raised here,
+    for the item it happened on.
+
+    This only helps where loading releases the GIL, as the Arrow readers (and numpy file reads) do.
+    """
+
+    loaded = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(result):
+        while not stop.is_set():
+            try:
+                loaded.put(result, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def work():
+        for item in items:
+            if stop.is_set():
+                return
+            try:
+                put((item, load(item), None))
+            except Exception as e:
+                put((item, None, e))
+                return
+        put(None)
+
+    thread = threading.Thread(target=work, daemon=True)
+    thread.start()
+    try:
+        while True:
+            result = loaded.get()
+            if result is None:
+                return
+            item, value, error = result
+            if error is not None:
+                raise error
+            yield item, value
+    finally:
+        stop.set()
+        thread.join()
+
+
+class BackgroundWriter:
+    """
+    Runs writes (any function, e.g. write_settlements) in order in a background thread, so that e.g. a country's
+    results are written while the next country runs. submit blocks while depth writes are waiting, which bounds the
+    memory held by them.
+
+    Writes that fail are returned by close, to be retried or raised by the caller (e.g. for files that are open
+    elsewhere). If the main thread stops with an exception, the waiting writes are still finished.
+    """
+
+    def __init__(self, depth=1):
+        self.writes = queue.Queue(maxsize=depth)
+        self.failed = []
+        self.thread = threading.Thread(target=self.work)
+        self.thread.start()
+
+    def work(self):
+        while True:
+            try:
+                write = self.writes.get(timeout=1)
+            except queue.Empty:
+                if not threading.main_thread().is_alive():
+                    return
+                continue
+            if write is None:
+                return
+
+            function, args, kwargs = write
+            try:
+                function(*args, **kwargs)
+            except Exception as e:
+                logging.info('Writing in the background failed: {}'.format(e))
+                self.failed.append((function, args, kwargs, e))
+
+    def submit(self, function, *args, **kwargs):
+        self.writes.put((function, args, kwargs))
+
+    def close(self):
+        """
+        Waits for the writes to finish, and returns the failed ones as (function, args, kwargs, exception)
+        """
+
+        self.writes.put(None)
+        self.thread.join()
+        return self.failed
+
+
+class GridTableCache:
+    """
+    A directory of grid tables (as .npz files) named by a hash of everything they depend on: the grid Technology's
+    parameters and config, energy_per_hh, num_people_per_hh and max_dist. Used by Technology.get_grid_table, so that
+    tables are only built once across countries and scenarios.
+
+    The least recently used tables are removed when the files add up to more than max_size bytes.
+    """
+
+    version = 2  # change when the table calculation changes, so old tables are no longer used
+
+    def __init__(self, directory, max_size=256 * 1024 ** 2):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def get_key(self, calc, energy_per_hh, num_people_per_hh, max_dist, people):
+        """
+        The hash of the table inputs, with numbers as floats so that e.g. 5 and np.float64(5.0) give the same key.
+        """
+
+        def normalise(value):
+            if isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_)):
+                return float(value)
+            return value
+
+        parameters = {key: value for key, value in vars(calc).items() if not key.startswith('_')}
+        parameters.update(calc.config._asdict())
+        parameters.update(energy_per_hh=energy_per_hh, num_people_per_hh=num_people_per_hh, max_dist=max_dist,
+                          people=hashlib.sha1(np.asarray(people, dtype=float).tobytes()).hexdigest(),
+                          version=self.version)
+        text = repr(sorted((key, normalise(value)) for key, value in parameters.items()))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, '{}.npz'.format(key))
+
+    def load(self, key):
+        """
+        Returns the cached GridTable for key, or None if there is none.
+        """
+
+        path = self.get_path(key)
+        try:
+            with np.load(path) as data:
+                grid_table = GridTable(lcoes=data['lcoes'], people=data['people'], distances=data['distances'],
+                                       grid_price=float(data['grid_price']))
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+
+        os.utime(path)  # mark as recently used
+        self.hits += 1
+        return grid_table
+
+    def save(self, key, grid_table):
+        """
+        Writes the table (through a temporary file, so that concurrent runs never read a partial one) and evicts the
+        least recently used tables if the cache is over its size.
+        """
+
+        handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(handle, 'wb') as f:
+            np.savez(f, **grid_table._asdict())
+        os.replace(temp_path, self.get_path(key))
+        self.evict()
+
+    def evict(self):
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.npz')]
+        files = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+class GridLcoeTable:
+    """
+    The rural and urban grid tables of a scenario, with the population bins and rounding used to index them, so that
+    the electrification algorithm can look up the grid LCOEs of many settlements at once.
+
+    With interpolate, the LCOEs are instead interpolated bilinearly in population and distance, from tables over the
+    much coarser coarse_people bins. This avoids the steps from rounding the population and the distance.
+
+    The grid price only adds to the grid LCOE (the fuel cost per kWh), so LCOEs for other grid prices, e.g. regional
+    tariffs, come from the same tables as table LCOE - table grid price + grid price.
+    """
+
+    # Coarser resolution at the high end (just to catch the few places with exceptional population density)
+    people = np.concatenate([np.arange(1000), np.arange(1000, 10000, 10), np.arange(10000, 350000, 1000)])
+
+    # Geometric bins for interpolation, the grid LCOE changes fastest at low populations
+    coarse_people = np.concatenate([[0], np.unique(np.round(np.geomspace(1, 350000, 120)))])
+
+    def __init__(self, rural, urban, interpolate=False, grid_calc=None, demand=None, max_dist=None):
+        self.rural = rural
+        self.urban = urban
+        self.interpolate = interpolate
+
+        # With the grid Technology, the (energy_per_hh, num_people_per_hh) of the rural and urban tables (a dict) and
+        # max_dist, population bins missing from the tables are added as lookup comes across them
+        self.grid_calc = grid_calc
+        self.demand = demand
+        self.max_dist = max_dist
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_technology(cls, grid_calc, energy_per_hh_rural, num_people_per_hh_rural, energy_per_hh_urban,
+                        num_people_per_hh_urban, max_dist, cache=None, interpolate=False, people=None, is_urban=None):
+        """
+        Builds (or takes from the GridTableCache) the rural and urban tables with Technology.get_grid_table. With
+        interpolate, the coarse tables are built and their interpolation error is logged.
+
+        With the populations in people (and whether each settlement is urban in is_urban), the tables only cover the
+        population bins these need, e.g. for the unelectrified settlements of a country (see
+        SettlementProcessor.get_grid_table_settlements). Any other bins are added by lookup when needed.
+        """
+
+        all_people = cls.coarse_people if interpolate else cls.people
+
+        def get_people(urban):
+            if people is None:
+                return all_people
+            rows = slice(None) if is_urban is None else np.asarray(is_urban, dtype=bool) == urban
+            bins = cls.get_people_bins(np.asarray(people, dtype=float)[rows], interpolate)
+            return np.union1d(bins, all_people[:2])  # at least one cell to interpolate in
+
+        rural = grid_calc.get_grid_table(energy_per_hh_rural, num_people_per_hh_rural, max_dist, cache=cache,
+                                         people=get_people(False))
+        urban = grid_calc.get_grid_table(energy_per_hh_urban, num_people_per_hh_urban, max_dist, cache=cache,
+                                         people=get_people(True))
+        demand = {'rural': (energy_per_hh_rural, num_people_per_hh_rural),
+                  'urban': (energy_per_hh_urban, num_people_per_hh_urban)}
+        grid_lcoes = cls(rural, urban, interpolate, grid_calc=grid_calc, demand=demand, max_dist=max_dist)
+
+        if interpolate:
+            for name, table, energy_per_hh, num_people_per_hh in (
+                    ('rural', rural, energy_per_hh_rural, num_people_per_hh_rural),
+                    ('urban', urban, energy_per_hh_urban, num_people_per_hh_urban)):
+                max_error, mean_error = grid_lcoes.get_interpolation_error(table, grid_calc, energy_per_hh,
+                                                                           num_people_per_hh)
+                logging.info('Grid table interpolation error ({}): max {:.2%}, mean {:.2%}'.format(
+                    name, max_error, mean_error))
+
+        return grid_lcoes
+
+    def publish(self, directory):
+        """
+        Writes the tables to directory as .npy files, so that other processes (e.g. workers running countries or
+        scenarios in parallel) can attach them with GridLcoeTable.attach instead of building their own. The files are
+        memory-mapped read-only there, so all workers share the same memory. The demand and max_dist of the tables are
+        written too, so that workers attaching with the grid Technology can still add missing population bins.
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        arrays = {'interpolate': np.array(self.interpolate)}
+        if self.demand is not None:
+            arrays['max_dist'] = np.array(self.max_dist, dtype=float)
+        for name, table in (('rural', self.rural), ('urban', self.urban)):
+            for field, array in table._asdict().items():
+                arrays['{}_{}'.format(name, field)] = np.asarray(array)
+            if self.demand is not None:
+                arrays['{}_demand'.format(name)] = np.array(self.demand[name], dtype=float)
+
+        # Through temporary files, so that a worker attaching early never maps a partial table
+        for name, array in arrays.items():
+            handle, temp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+            with os.fdopen(handle, 'wb') as f:
+                np.save(f, array)
+            os.replace(temp_path, os.path.join(directory, '{}.npy'.format(name)))
+
+    @classmethod
+    def attach(cls, directory, grid_calc=None):
+        """
+        Returns the GridLcoeTable published to directory, with the tables memory-mapped read-only. With the grid
+        Technology the tables were built with in grid_calc, population bins missing from them are added as in the
+        process that published them (into the worker's own memory).
+        """
+
+        def load(name):
+            return np.load(os.path.join(directory, '{}.npy'.format(name)), mmap_mode='r')
+
+        rural, urban = [GridTable(lcoes=load('{}_lcoes'.format(name)),
+                                  people=load('{}_people'.format(name)),
+                                  distances=load('{}_distances'.format(name)),
+                                  grid_price=float(load('{}_grid_price'.format(name))))
+                        for name in ('rural', 'urban')]
+
+        demand = max_dist = None
+        if grid_calc is not None:
+            if not os.path.exists(os.path.join(directory, 'max_dist.npy')):
+                raise ValueError('The grid tables in {} were published without their demand'.format(directory))
+            demand = {name: tuple(float(value) for value in load('{}_demand'.format(name)))
+                      for name in ('rural', 'urban')}
+            max_dist = float(load('max_dist'))
+        return cls(rural, urban, interpolate=bool(load('interpolate')), grid_calc=grid_calc, demand=demand,
+                   max_dist=max_dist)
+
+    @staticmethod
+    def get_interpolation_error(table, grid_calc, energy_per_hh, num_people_per_hh):
+        """
+        The maximum and mean relative error of the interpolation against direct LCOE calculations, at the centres of
+        the table cells (where bilinear interpolation is furthest from the table values). Cells below one person are
+        left out.
+        """
+
+        # Only between neighbouring coarse bins, as lookup never interpolates across bins left out of a table
+        bin_index = np.searchsorted(GridLcoeTable.coarse_people, table.people)
+        people_centres = (table.people[1:] + table.people[:-1]) / 2
+        people_centres = people_centres[(table.people[:-1] >= 1) & (bin_index[1:] == bin_index[:-1] + 1)]
+        distance_centres = (table.distances[1:] + table.distances[:-1]) / 2
+
+        direct = grid_calc.get_lcoe_batch(energy_per_hh=energy_per_hh,
+                                          people=people_centres[:, None],
+                                          num_people_per_hh=num_people_per_hh,
+                                          additional_mv_line_length=distance_centres[None, :])
+        interpolated = GridLcoeTable.interpolate_table(table, people_centres[:, None], distance_centres[None, :])
+
+        error = np.abs(interpolated / direct - 1)
+        return error.max(), error.mean()
+
+    @staticmethod
+    def interpolate_table(table, people, dist):
+        """
+        Bilinear interpolation in a GridTable, with the population and distance kept within the table.
+        """
+
+        i, t = GridLcoeTable.get_weights(table.people, people)
+        j, u = GridLcoeTable.get_weights(table.distances, dist)
+        lcoes = table.lcoes
+
+        return (1 - t) * (1 - u) * lcoes[i, j] + t * (1 - u) * lcoes[i + 1, j] + \
+            (1 - t) * u * lcoes[i, j + 1] + t * u * lcoes[i + 1, j + 1]
+
+    @staticmethod
+    def get_weights(axis, values):
+        """
+        The index of the interval of axis each value (clipped to the axis) is in, and its position within the interval.
+        """
+
+        axis = np.asarray(axis, dtype=float)
+        values = np.clip(np.asarray(values, dtype=float), axis[0], axis[-1])
+        index = np.clip(np.searchsorted(axis, values, side='right') - 1, 0, len(axis) - 2)
+        return index, (values - axis[index]) / (axis[index + 1] - axis[index])
+
+    @staticmethod
+    def get_people_index(table, people):
+        """
+        The rows of a GridTable for populations already rounded with round_people.
+        """
+
+        people_index = np.searchsorted(table.people, people)
+        if np.any(people_index >= len(table.people)) or \
+                np.any(table.people[np.minimum(people_index, len(table.people) - 1)] != people):
+            raise ValueError('Population outside the bins of the grid table')
+        return people_index
+
+    @staticmethod
+    def get_people_bins(people, interpolate):
+        """
+        The population bins needed to look up people: rounded with round_people, or when interpolating, the coarse
+        bins on either side.
+        """
+
+        if not interpolate:
+            return np.unique(GridLcoeTable.round_people(people))
+
+        coarse_people = GridLcoeTable.coarse_people
+        index = np.clip(np.searchsorted(coarse_people, people, side='right') - 1, 0, len(coarse_people) - 2)
+        return np.unique(np.concatenate([coarse_people[index], coarse_people[index + 1]]))
+
+    def fill(self, name, people):
+        """
+        Returns the rural or urban table (by name), after adding any population bins for people that it was built
+        without. Tables without a grid Technology (e.g. attached without one) are returned as they are.
+        """
+
+        table = getattr(self, name)
+        if self.grid_calc is None:
+            return table
+
+        bins = self.get_people_bins(people, self.interpolate)
+        index = np.minimum(np.searchsorted(table.people, bins), len(table.people) - 1)
+        if np.all(table.people[index] == bins):
+            return table
+
+        with self.lock:
+            table = getattr(self, name)
+            missing = np.setdiff1d(bins, table.people)
+            if len(missing):
+                energy_per_hh, num_people_per_hh = self.demand[name]
+                added = self.grid_calc.get_grid_table(energy_per_hh, num_people_per_hh, self.max_dist, people=missing)
+                people = np.concatenate([table.people, added.people])
+                order = np.argsort(people)
+                table = table._replace(lcoes=np.concatenate([table.lcoes, added.lcoes])[order], people=people[order])
+                setattr(self, name, table)
+                logging.info('Added {} population bins to the {} grid table'.format(len(missing), name))
+        return table
+
+    @staticmethod
+    def round_people(people):
+        """
+        Rounds populations to the table bins: whole people below 1,000, the nearest 10 below 10,000 and the nearest
+        1,000 above.
+        """
+
+        people = np.asarray(people, dtype=float)
+        return np.where(people < 1000, np.trunc(people),
+                        np.where(people < 10000, 10 * np.round(people / 10), 1000 * np.round(people / 1000)))
+
+    def lookup(self, people, dist, urban, grid_price=None, energy_per_hh=None):
+        """
+        Returns the grid LCOEs for arrays (or scalars) of populations, additional MV line lengths in km (rounded down
+        to the whole km, unless interpolating) and whether the settlements are urban. grid_price optionally gives the
+        grid price per settlement, otherwise the price the tables were built with is used.
+
+        The tables are for the rural and urban demand they were built with, energy_per_hh is only taken for the same
+        interface as DemandGridLcoeTable.
+        """
+
+        if grid_price is None:
+            grid_price = np.nan  # marks the table's own price
+        people, dist, urban, grid_price = np.broadcast_arrays(np.asarray(people, dtype=float),
+                                                              np.asarray(dist, dtype=float),
+                                                              np.asarray(urban, dtype=bool),
+                                                              np.asarray(grid_price, dtype=float))
+        lcoes = np.empty(people.shape)
+
+        if not self.interpolate:
+            people = self.round_people(people)
+            dist_index = dist.astype(int)
+
+        for name, rows in (('urban', urban), ('rural', ~urban)):
+            table = self.fill(name, people[rows])
+            if self.interpolate:
+                lcoes[rows] = self.interpolate_table(table, people[rows], dist[rows])
+            else:
+                lcoes[rows] = table.lcoes[self.get_people_index(table, people[rows]), dist_index[rows]]
+
+            regional = rows & ~np.isnan(grid_price)
+            lcoes[regional] += grid_price[regional] - table.grid_price
+
+        return lcoes
+
+    def max_viable_dist(self, people, urban, max_lcoes, grid_price=None, energy_per_hh=None):
+        """
+        Inverts the tables in distance: returns for each settlement the additional MV line length in km (penalty
+        adjusted) below which its grid LCOE from lookup stays under max_lcoes, e.g. its best off-grid LCOE. See
+        invert_lookup.
+        """
+
+        for table in (self.rural, self.urban):
+            if np.any(np.diff(table.lcoes, axis=1) < 0):
+                raise ValueError('The grid table LCOEs decrease with the distance')
+
+        people, urban, max_lcoes = np.broadcast_arrays(people, urban, max_lcoes)
+        return self.invert_lookup(lambda dist: self.lookup(people, dist, urban, grid_price), self.rural.distances,
+                                  max_lcoes, self.interpolate)
+
+    @staticmethod
+    def invert_lookup(lookup, distances, max_lcoes, interpolate):
+        """
+        With lookup giving the grid LCOEs of the settlements at a distance (one per settlement) and only increasing
+        with the distance, returns the distances below which the LCOEs stay under max_lcoes. This is zero where the
+        grid never gets below max_lcoes, and the end of the table distances (inf when interpolating, as the distances
+        are kept within the table) where it always does. Each settlement is found by bisection over the distances.
+        """
+
+        distances = np.asarray(distances, dtype=float)
+        max_lcoes = np.asarray(max_lcoes, dtype=float)
+
+        # The number of distances from the start of the table with an LCOE under max_lcoes
+        size = len(distances)
+        low = np.zeros(max_lcoes.shape, dtype=int)
+        high = np.full(max_lcoes.shape, size)
+        while np.any(low < high):
+            middle = (low + high) // 2
+            below = lookup(distances[np.minimum(middle, size - 1)]) < max_lcoes
+            active = low < high
+            low = np.where(active & below, middle + 1, low)
+            high = np.where(active & ~below, middle, high)
+
+        if not interpolate:
+            # lookup rounds the distances down to the whole km of the table
+            return low.astype(float)
+
+        # Where the grid LCOE crosses max_lcoes, linearly between the last distance below and the next one
+        last = np.clip(low - 1, 0, size - 2)
+        before, after = lookup(distances[last]), lookup(distances[last + 1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing = distances[last] + (max_lcoes - before) / (after - before) * \
+                (distances[last + 1] - distances[last])
+        return np.where(low == 0, 0, np.where(low == size, np.inf, crossing))
+
+
+class DemandGridLcoeTable:
+    """
+    Grid LCOEs for continuous energy demand, e.g. per settlement from an income or productive use layer: interpolating
+    GridLcoeTables over the energies per household in energies, with the LCOEs interpolated linearly in 1 / energy
+    between them (the costs per kWh that don't scale with the demand fall with its inverse). The tables are built
+    once for all demand values, over the coarse populations only, as full tables for every energy would take
+    gigabytes.
+    """
+
+    # Energy demand bins in kWh/household/year, from below tier 1 to well above tier 5
+    energies = np.geomspace(10, 20000, 34)
+
+    interpolate = True  # the LCOEs are always interpolated, also in distance
+
+    def __init__(self, energies, grid_lcoes):
+        self.energies = np.asarray(energies, dtype=float)
+        self.grid_lcoes = grid_lcoes
+
+    @classmethod
+    def from_technology(cls, grid_calc, num_people_per_hh_rural, num_people_per_hh_urban, max_dist, energies=None,
+                        cache=None, people=None, is_urban=None):
+        """
+        Builds (or takes from the GridTableCache) the rural and urban tables for each energy with
+        GridLcoeTable.from_technology (also for people and is_urban).
+        """
+
+        energies = cls.energies if energies is None else np.sort(np.asarray(energies, dtype=float))
+        grid_lcoes = [GridLcoeTable.from_technology(grid_calc, energy_per_hh, num_people_per_hh_rural, energy_per_hh,
+                                                    num_people_per_hh_urban, max_dist, cache=cache, interpolate=True,
+                                                    people=people, is_urban=is_urban)
+                      for energy_per_hh in energies]
+        return cls(energies, grid_lcoes)
+
+    @classmethod
+    def get_energies(cls, energy_per_hh):
+        """
+        The default energies, extended with bins at the same spacing to cover the (positive) energy demand per
+        household of the settlements in energy_per_hh. The default bins are kept, so that their cached tables are
+        reused.
+        """
+
+        energy_per_hh = np.asarray(energy_per_hh, dtype=float)
+        energy_per_hh = energy_per_hh[energy_per_hh > 0]
+        energies = cls.energies
+        if not len(energy_per_hh):
+            return energies
+
+        step = np.log(energies[1] / energies[0])
+        below = max(0, int(np.ceil(np.log(energies[0] / energy_per_hh.min()) / step)))
+        above = max(0, int(np.ceil(np.log(energy_per_hh.max() / energies[-1]) / step)))
+        energies = np.concatenate([energies[0] * np.exp(-step * np.arange(below, 0, -1)), energies,
+                                   energies[-1] * np.exp(step * np.arange(1, above + 1))])
+        # Against rounding in the added end bins
+        energies[0] = min(energies[0], energy_per_hh.min())
+        energies[-1] = max(energies[-1], energy_per_hh.max())
+        return energies
+
+    def lookup(self, people, dist, urban, grid_price=None, energy_per_hh=None):
+        """
+        Returns the grid LCOEs as GridLcoeTable.lookup, for the energy demand per household in energy_per_hh (array
+        or scalar, within the energies of the tables, see get_energies). Settlements without a positive demand have
+        no LCOE (NaN), as in a direct calculation.
+        """
+
+        if energy_per_hh is None:
+            raise ValueError('The energy demand per household is needed for continuous demand grid tables')
+        if grid_price is None:
+            grid_price = np.nan
+        people, dist, urban, grid_price, energy_per_hh = np.broadcast_arrays(
+            np.asarray(people, dtype=float), np.asarray(dist, dtype=float), np.asarray(urban, dtype=bool),
+            np.asarray(grid_price, dtype=float), np.asarray(energy_per_hh, dtype=float))
+        demand = energy_per_hh > 0
+        if np.any(demand & ((energy_per_hh < self.energies[0]) | (energy_per_hh > self.energies[-1]))):
+            raise ValueError('Energy demand outside the range of the grid tables')
+
+        index, t = GridLcoeTable.get_weights(-1 / self.energies, -1 / np.where(demand, energy_per_hh, np.inf))
+        lcoes = np.full(people.shape, np.nan)
+        for i in np.unique(index[demand]):
+            rows = demand & (index == i)
+            lower, upper = [grid_lcoes.lookup(people[rows], dist[rows], urban[rows], grid_price[rows])
+                            for grid_lcoes in self.grid_lcoes[i:i + 2]]
+            lcoes[rows] = (1 - t[rows]) * lower + t[rows] * upper
+
+        return lcoes
+
+    def max_viable_dist(self, people, urban, max_lcoes, grid_price=None, energy_per_hh=None):
+        """
+        As GridLcoeTable.max_viable_dist, for the energy demand per household in energy_per_hh.
+        """
+
+        for grid_lcoes in self.grid_lcoes:
+            for table in (grid_lcoes.rural, grid_lcoes.urban):
+                if np.any(np.diff(table.lcoes, axis=1) < 0):
+                    raise ValueError('The grid table LCOEs decrease with the distance')
+
+        people, urban, max_lcoes = np.broadcast_arrays(people, urban, max_lcoes)
+        return GridLcoeTable.invert_lookup(lambda dist: self.lookup(people, dist, urban, grid_price, energy_per_hh),
+                                           self.grid_lcoes[0].rural.distances, max_lcoes, True)
+
+
+def _lcoe_kernel(energy_per_hh, people, num_people_per_hh, additional_mv_line_length, capacity_factor,
+                 mv_line_length, travel_hours, lcoe, investment_cost, installed_capacity, peak_load, td_length,
+                 is_grid, standalone, is_diesel, default_capacity_factor, distribution_losses, base_to_peak_load_ratio,
+                 grid_cell_area, mv_line_capacity, lv_line_capacity, lv_line_max_length, mv_line_max_length,
+                 hv_line_cost, mv_line_cost, lv_line_cost, hv_lv_transformer_cost, mv_increase_rate,
+                 connection_cost_per_hh, om_of_td_lines, grid_price, capital_cost, om_costs, diesel_price,
+                 diesel_truck_consumption, diesel_truck_volume, efficiency, grid_capacity_investment,
+                 investment_factor, salvage_factor, annuity_factor):
+    """
+    Compiled version of Technology.get_lcoe_result, one settlement per iteration, writing into the five output arrays.
+    Covers the grid, standalone, mini-grid and diesel branches, and is only used when Numba is installed.
+    """
+
+    for i in prange(people.shape[0]):
+        no_people = people[i] == 0
+        pop = 0.00001 if no_people else people[i]
+        cf = default_capacity_factor if capacity_factor[i] == 0 else capacity_factor[i]
+
+        households = pop / num_people_per_hh[i]
+        consumption = households * energy_per_hh[i]
+        average_load = consumption * (1 + distribution_losses) / HOURS_PER_YEAR
+        peak = average_load / base_to_peak_load_ratio
+
+        no_mv_lines = peak / mv_line_capacity
+        no_lv_lines = peak / lv_line_capacity
+        lv_networks_lim_capacity = no_lv_lines / no_mv_lines
+        lv_networks_lim_length = ((grid_cell_area / no_mv_lines) / (lv_line_max_length / sqrt(2))) ** 2
+        actual_lv_lines = min(households, max(lv_networks_lim_capacity, lv_networks_lim_length))
+        hh_per_lv_network = households / (actual_lv_lines * no_mv_lines)
+        lv_unit_length = sqrt(grid_cell_area / households) * sqrt(2) / 2
+        lv_lines_length_per_lv_network = 1.333 * hh_per_lv_network * lv_unit_length
+        total_lv_lines_length = no_mv_lines * actual_lv_lines * lv_lines_length_per_lv_network
+        line_reach = (grid_cell_area / no_mv_lines) / (2 * sqrt(grid_cell_area / no_lv_lines))
+        total_length_of_lines = min(line_reach, mv_line_max_length) * no_mv_lines
+        additional_hv_lines = max(0.0, round(sqrt(grid_cell_area) / (2 * min(line_reach, mv_line_max_length)) / 10,
+                                             3) - 1)
+        hv_lines_total_length = (sqrt(grid_cell_area) / 2) * additional_hv_lines * sqrt(grid_cell_area)
+        num_transformers = additional_hv_lines + no_mv_lines + (no_mv_lines * actual_lv_lines)
+        generation_per_year = average_load * HOURS_PER_YEAR
+
+        if is_grid:
+            mv_length = additional_mv_line_length[i]
+            total_investment_cost = hv_lines_total_length * hv_line_cost + \
+                total_length_of_lines * mv_line_cost + \
+                total_lv_lines_length * lv_line_cost + \
+                num_transformers * hv_lv_transformer_cost + \
+                households * connection_cost_per_hh + \
+                mv_length * (mv_line_cost * (1 + mv_increase_rate) ** ((mv_length / 5) - 1))
+            total_om_cost = total_investment_cost * om_of_td_lines
+            fuel_cost = grid_price
+            capacity = peak / cf
+            length = hv_lines_total_length + total_length_of_lines + total_lv_lines_length + mv_length
+        else:
+            if standalone:
+                total_lv_lines_length = 0.0
+            else:
+                total_lv_lines_length *= 0.75
+            capacity = peak / cf
+            td_investment_cost = mv_line_cost * mv_line_length[i] + lv_line_cost * total_lv_lines_length + \
+                households * connection_cost_per_hh
+            total_investment_cost = td_investment_cost + capacity * capital_cost
+            total_om_cost = td_investment_cost * om_of_td_lines + capital_cost * om_costs * capacity
+            if is_diesel:
+                fuel_cost = (diesel_price + 2 * diesel_price * diesel_truck_consumption * travel_hours[i] /
+                             diesel_truck_volume) / LHV_DIESEL / efficiency
+            else:
+                fuel_cost = 0.0
+            length = mv_line_length[i] + total_lv_lines_length
+
+        discounted_costs = total_investment_cost * (investment_factor - salvage_factor) + \
+            (total_om_cost + generation_per_year * fuel_cost) * annuity_factor
+        lcoe[i] = discounted_costs / (generation_per_year * annuity_factor)
+
+        if no_people:
+            investment_cost[i] = 0.0
+            installed_capacity[i] = 0.0
+            peak_load[i] = 0.0
+            td_length[i] = 0.0
+        else:
+            investment_cost[i] = total_investment_cost * investment_factor + grid_capacity_investment * peak
+            installed_capacity[i] = capacity
+            peak_load[i] = peak
+            td_length[i] = length
+
+
+if NUMBA_AVAILABLE:
+    _lcoe_kernel = njit(parallel=True, nogil=True)(_lcoe_kernel)
+
+# The kernel is parallel itself, and not all Numba threading layers allow launching it from several threads at once
+_lcoe_kernel_lock = threading.Lock()
+
 
 class Technology:
     """
@@ -106,20 +1378,22 @@ class Technology:
     input parameters.
     """
 
-    start_year = 2015
-    end_year = 2030
-    discount_rate = 0.08
-    grid_cell_area = 1  # in km2, normally 1km2
-
-    mv_line_cost = 9000  # USD/km
-    lv_line_cost = 5000  # USD/km
-    mv_line_capacity = 50  # kW/line
-    lv_line_capacity = 10  # kW/line
-    lv_line_max_length = 30  # km
-    hv_line_cost = 53000  # USD/km
-    mv_line_max_length = 50  # km
-    hv_lv_transformer_cost = 5000  # USD/unit
-    mv_increase_rate = 0.1  # percentage
+    # The scenario-wide parameters, used by all instances that aren't given their own config
+    default_config = TechnologyConfig(start_year=2015,
+                                      end_year=2030,
+                                      discount_rate=0.08,
+                                      grid_cell_area=1,  # in km2, normally 1km2
+                                      mv_line_cost=9000,  # USD/km
+                                      lv_line_cost=5000,  # USD/km
+                                      mv_line_capacity=50,  # kW/line
+                                      lv_line_capacity=10,  # kW/line
+                                      lv_line_max_length=30,  # km
+                                      hv_line_cost=53000,  # USD/km
+                                      mv_line_max_length=50,  # km
+                                      hv_lv_transformer_cost=5000,  # USD/unit
+                                      mv_increase_rate=0.1)  # percentage
+
+    use_compiled = NUMBA_AVAILABLE  # use the Numba LCOE kernel in get_lcoe_result (if installed)
 
     def __init__(self,
                  tech_life,  # in years
@@ -136,7 +1410,8 @@ class Technology:
                  grid_capacity_investment=0.0,  # USD/kW for on-grid capacity investments (excluding grid itself)
                  diesel_truck_consumption=0,  # litres/hour
                  diesel_truck_volume=0,  # litres
-                 om_of_td_lines=0):  # percentage
+                 om_of_td_lines=0,  # percentage
+                 config=None):  # TechnologyConfig, or None to use Technology.default_config
 
         self.distribution_losses = distribution_losses
         self.connection_cost_per_hh = connection_cost_per_hh
@@ -153,24 +1428,36 @@ class Technology:
         self.diesel_truck_consumption = diesel_truck_consumption
         self.diesel_truck_volume = diesel_truck_volume
         self.om_of_td_lines = om_of_td_lines
+        self._config = config
+
+        # (key, factors) as a single attribute, so that threads sharing the instance never see a mismatched pair
+        self._discount_factors = (None, None)
+
+    @property
+    def config(self):
+        return self._config if self._config is not None else Technology.default_config
+
+    def __getattr__(self, name):
+        # The scenario-wide values (e.g. self.discount_rate) are read from the config
+        if name in TechnologyConfig._fields:
+            return getattr(self.config, name)
+        raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
 
     @classmethod
     def set_default_values(cls, start_year, end_year, discount_rate, grid_cell_area, mv_line_cost, lv_line_cost,
                            mv_line_capacity, lv_line_capacity, lv_line_max_length, hv_line_cost, mv_line_max_length,
                            hv_lv_transformer_cost, mv_increase_rate):
-        cls.start_year = start_year
-        cls.end_year = end_year
-        cls.discount_rate = discount_rate
-        cls.grid_cell_area = grid_cell_area
-        cls.mv_line_cost = mv_line_cost
-        cls.lv_line_cost = lv_line_cost
-        cls.mv_line_capacity = mv_line_capacity
-        cls.lv_line_capacity = lv_line_capacity
-        cls.lv_line_max_length = lv_line_max_length
-        cls.hv_line_cost = hv_line_cost
-        cls.mv_line_max_length = mv_line_max_length
-        cls.hv_lv_transformer_cost = hv_lv_transformer_cost
-        cls.mv_increase_rate = mv_increase_rate
+        """
+        Kept for compatibility, this replaces Technology.default_config and so affects all instances without their own
+        config. The values are read from Technology.default_config (e.g. Technology.default_config.discount_rate),
+        rather than as class attributes as before. Pass a TechnologyConfig to each instance instead to run different
+        scenarios at the same time.
+        """
+
+        Technology.default_config = TechnologyConfig(start_year, end_year, discount_rate, grid_cell_area,
+                                                     mv_line_cost, lv_line_cost, mv_line_capacity, lv_line_capacity,
+                                                     lv_line_max_length, hv_line_cost, mv_line_max_length,
+                                                     hv_lv_transformer_cost, mv_increase_rate)
 
     def get_lcoe(self, energy_per_hh, people, num_people_per_hh, additional_mv_line_length=0, capacity_factor=0,
                  mv_line_length=0, travel_hours=0, get_investment_cost=False):
@@ -255,6 +1542,279 @@ class Technology:
                 fuel_cost = 0
 
         # Perform the time-value LCOE calculation
+        investment_factor, salvage_factor, annuity_factor = self.get_discount_factors()
+
+        # So we also return the total investment cost for this number of people
+        if get_investment_cost:
+            return total_investment_cost * investment_factor + self.grid_capacity_investment * peak_load
+        else:
+            discounted_costs = total_investment_cost * (investment_factor - salvage_factor) + \
+                               (total_om_cost + generation_per_year * fuel_cost) * annuity_factor
+            return discounted_costs / (generation_per_year * annuity_factor)
+
+    def get_lcoe_batch(self, energy_per_hh, people, num_people_per_hh, additional_mv_line_length=0,
+                       capacity_factor=0, mv_line_length=0, travel_hours=0, get_investment_cost=False):
+        """
+        Array version of get_lcoe, giving the same results for whole columns of settlements at once.
+
+        All parameters can be scalars or NumPy arrays (broadcast against each other), and an array of LCOEs (or
+        investment costs) is returned.
+        """
+
+        result = self.get_lcoe_result(energy_per_hh, people, num_people_per_hh, additional_mv_line_length,
+                                      capacity_factor, mv_line_length, travel_hours)
+        return result.investment_cost if get_investment_cost else result.lcoe
+
+    def get_lcoe_result(self, energy_per_hh, people, num_people_per_hh, additional_mv_line_length=0,
+                        capacity_factor=0, mv_line_length=0, travel_hours=0):
+        """
+        Calculates the LCOE together with the investment cost, installed capacity, peak load and T&D line length in a
+        single pass over the network sizing. Parameters are as for get_lcoe_batch, and an LcoeResult is returned.
+        """
+
+        inputs = self.broadcast_inputs(energy_per_hh, people, num_people_per_hh, additional_mv_line_length,
+                                       capacity_factor, mv_line_length, travel_hours)
+
+        if self.use_compiled and NUMBA_AVAILABLE:
+            return self._get_lcoe_result_compiled(*inputs)
+
+        return self._get_result(self._get_costs(*inputs))
+
+    def get_lcoe_sensitivities(self, energy_per_hh, people, num_people_per_hh, additional_mv_line_length=0,
+                               capacity_factor=0, mv_line_length=0, travel_hours=0):
+        """
+        Calculates the LcoeResult together with the partial derivatives of the LCOE with respect to the main drivers
+        (an LcoeSensitivities), in the same pass over the network sizing. Parameters are as for get_lcoe_batch, and a
+        tuple (LcoeResult, LcoeSensitivities) is returned.
+
+        The derivatives are exact for the closed form of the LCOE used here:
+        LCOE = I * (investment_factor - salvage_factor) / (G * annuity_factor) + O&M / G + fuel_cost
+        with I the investment, O&M the yearly O&M cost and G the yearly generation. The rounded number of additional HV
+        lines and the min/max choices in the network sizing are held at their current values.
+        """
+
+        inputs = self.broadcast_inputs(energy_per_hh, people, num_people_per_hh, additional_mv_line_length,
+                                       capacity_factor, mv_line_length, travel_hours)
+        costs = self._get_costs(*inputs, energy_derivatives=True)
+        result = self._get_result(costs)
+
+        investment_factor, salvage_factor, annuity_factor = self.get_discount_factors()
+        d_investment_factor, d_salvage_factor, d_annuity_factor = self.get_discount_factor_derivatives()
+        net_investment_factor = (investment_factor - salvage_factor) / annuity_factor
+
+        generation_per_year = costs['generation_per_year']
+        total_investment_cost = costs['total_investment_cost']
+        total_om_cost = costs['total_om_cost']
+        zeros = np.zeros_like(generation_per_year)
+
+        if self.grid_price > 0:
+            d_grid_price = np.ones_like(generation_per_year)
+            d_capital_cost = zeros
+            d_diesel_price = zeros
+        else:
+            d_grid_price = zeros
+            # The capital cost is part of both the investment and (through om_costs) the O&M
+            d_capital_cost = costs['installed_capacity'] * (net_investment_factor + self.om_costs) / generation_per_year
+            # The fuel cost is linear in the diesel price (including the transport by truck)
+            d_diesel_price = costs['fuel_cost'] / self.diesel_price if self.diesel_price > 0 else zeros
+
+        d_discount_rate = total_investment_cost / generation_per_year * (
+            (d_investment_factor - d_salvage_factor) * annuity_factor -
+            (investment_factor - salvage_factor) * d_annuity_factor) / annuity_factor ** 2
+
+        # The generation is proportional to the energy per household, so d(X / G) = (dX - X / energy) / G
+        energy_per_hh = inputs[0]
+        d_energy_per_hh = (net_investment_factor *
+                           (costs['d_investment_cost'] - total_investment_cost / energy_per_hh) +
+                           costs['d_om_cost'] - total_om_cost / energy_per_hh) / generation_per_year
+
+        return result, LcoeSensitivities(diesel_price=d_diesel_price,
+                                         capital_cost=d_capital_cost,
+                                         discount_rate=d_discount_rate,
+                                         grid_price=d_grid_price,
+                                         energy_per_hh=d_energy_per_hh)
+
+    @staticmethod
+    def broadcast_inputs(*args):
+        """
+        Turns the inputs of get_lcoe_result into float arrays of the same shape.
+        """
+
+        return np.broadcast_arrays(*[np.asarray(arg, dtype=float) for arg in args])
+
+    def _get_costs(self, energy_per_hh, people, num_people_per_hh, additional_mv_line_length, capacity_factor,
+                   mv_line_length, travel_hours, energy_derivatives=False):
+        """
+        The NumPy network sizing and cost calculation behind get_lcoe_result, on the already broadcast input arrays.
+        Returns a dict with the yearly generation, investment, O&M and fuel cost, and the other LcoeResult values.
+
+        With energy_derivatives, the derivatives of the investment and O&M cost with respect to the energy per
+        household are included as d_investment_cost and d_om_cost (the peak load and the number of MV and LV lines
+        are proportional to it).
+        """
+
+        # Same div/0 protection and capacity factor fallback as in get_lcoe, but element-wise
+        no_people = people == 0
+        people = np.where(no_people, 0.00001, people)
+        capacity_factor = np.where(capacity_factor == 0, self.capacity_factor, capacity_factor)
+
+        households = people / num_people_per_hh
+        consumption = households * energy_per_hh  # kWh/year
+        average_load = consumption * (1 + self.distribution_losses) / HOURS_PER_YEAR  # kW
+        peak_load = average_load / self.base_to_peak_load_ratio  # kW
+
+        no_mv_lines = peak_load / self.mv_line_capacity
+        no_lv_lines = peak_load / self.lv_line_capacity
+        lv_networks_lim_capacity = no_lv_lines / no_mv_lines
+        lv_networks_lim_length = ((self.grid_cell_area / no_mv_lines) / (self.lv_line_max_length / sqrt(2))) ** 2
+        actual_lv_lines = np.minimum(households, np.maximum(lv_networks_lim_capacity, lv_networks_lim_length))
+        hh_per_lv_network = households / (actual_lv_lines * no_mv_lines)
+        lv_unit_length = np.sqrt(self.grid_cell_area / households) * sqrt(2) / 2
+        lv_lines_length_per_lv_network = 1.333 * hh_per_lv_network * lv_unit_length
+        total_lv_lines_length = no_mv_lines * actual_lv_lines * lv_lines_length_per_lv_network
+        line_reach = (self.grid_cell_area / no_mv_lines) / (2 * np.sqrt(self.grid_cell_area / no_lv_lines))
+        total_length_of_lines = np.minimum(line_reach, self.mv_line_max_length) * no_mv_lines
+        additional_hv_lines = np.maximum(
+            0, np.round(sqrt(self.grid_cell_area) / (2 * np.minimum(line_reach, self.mv_line_max_length)) / 10, 3) - 1)
+        hv_lines_total_length = (sqrt(self.grid_cell_area) / 2) * additional_hv_lines * sqrt(self.grid_cell_area)
+        num_transformers = additional_hv_lines + no_mv_lines + (no_mv_lines * actual_lv_lines)
+        generation_per_year = average_load * HOURS_PER_YEAR
+        installed_capacity = peak_load / capacity_factor
+
+        # The investment and O&M costs are different for grid and non-grid solutions
+        if self.grid_price > 0:
+            td_investment_cost = hv_lines_total_length * self.hv_line_cost + \
+                                 total_length_of_lines * self.mv_line_cost + \
+                                 total_lv_lines_length * self.lv_line_cost + \
+                                 num_transformers * self.hv_lv_transformer_cost + \
+                                 households * self.connection_cost_per_hh + \
+                                 additional_mv_line_length * (
+                                     self.mv_line_cost * (1 + self.mv_increase_rate) **
+                                     ((additional_mv_line_length / 5) - 1))
+            td_om_cost = td_investment_cost * self.om_of_td_lines
+            total_investment_cost = td_investment_cost
+            total_om_cost = td_om_cost
+            fuel_cost = self.grid_price
+            td_length = hv_lines_total_length + total_length_of_lines + total_lv_lines_length + \
+                additional_mv_line_length
+
+        else:
+            total_lv_lines_length *= 0 if self.standalone else 0.75
+            mv_total_line_cost = self.mv_line_cost * mv_line_length
+            lv_total_line_cost = self.lv_line_cost * total_lv_lines_length
+            capital_investment = installed_capacity * self.capital_cost
+            td_investment_cost = mv_total_line_cost + lv_total_line_cost + households * self.connection_cost_per_hh
+            td_length = mv_line_length + total_lv_lines_length
+            td_om_cost = td_investment_cost * self.om_of_td_lines
+            total_investment_cost = td_investment_cost + capital_investment
+            total_om_cost = td_om_cost + (self.capital_cost * self.om_costs * installed_capacity)
+
+            # If a diesel price has been passed, the technology is diesel
+            if self.diesel_price > 0:
+                # And we apply the Szabo formula to calculate the transport cost for the diesel
+                fuel_cost = (self.diesel_price + 2 * self.diesel_price * self.diesel_truck_consumption * travel_hours /
+                             self.diesel_truck_volume) / LHV_DIESEL / self.efficiency
+            # Otherwise it's hydro/wind etc with no fuel cost
+            else:
+                fuel_cost = np.zeros_like(generation_per_year)
+
+        costs = {'no_people': no_people, 'generation_per_year': generation_per_year, 'peak_load': peak_load,
+                 'installed_capacity': installed_capacity, 'td_length': td_length,
+                 'total_investment_cost': total_investment_cost, 'total_om_cost': total_om_cost,
+                 'fuel_cost': fuel_cost}
+
+        if energy_derivatives:
+            # The lines and the capacity scale with the peak load, and so with the energy per household, except the LV
+            # line length (the lines per network and households per line cancel out) and the rounded HV lines
+            d_no_mv_lines = no_mv_lines / energy_per_hh
+            lim_length = (lv_networks_lim_length > lv_networks_lim_capacity) & (actual_lv_lines < households)
+            d_actual_lv_lines = np.where(lim_length, -2 * lv_networks_lim_length / energy_per_hh, 0)
+            # The line reach goes with energy ** -0.5, so the MV lines length with energy ** 0.5 unless at the maximum
+            d_total_length_of_lines = np.where(line_reach < self.mv_line_max_length, 0.5, 1) * \
+                total_length_of_lines / energy_per_hh
+            d_num_transformers = d_no_mv_lines * (1 + actual_lv_lines) + no_mv_lines * d_actual_lv_lines
+
+            if self.grid_price > 0:
+                d_investment_cost = d_total_length_of_lines * self.mv_line_cost + \
+                    d_num_transformers * self.hv_lv_transformer_cost
+                d_om_cost = d_investment_cost * self.om_of_td_lines
+            else:
+                d_installed_capacity = installed_capacity / energy_per_hh
+                d_investment_cost = d_installed_capacity * self.capital_cost
+                d_om_cost = self.capital_cost * self.om_costs * d_installed_capacity
+
+            costs['d_investment_cost'] = d_investment_cost
+            costs['d_om_cost'] = d_om_cost
+
+        return costs
+
+    def _get_result(self, costs):
+        """
+        Discounts the costs from _get_costs into the LCOE and investment cost, and returns the LcoeResult.
+        """
+
+        investment_factor, salvage_factor, annuity_factor = self.get_discount_factors()
+
+        discounted_costs = costs['total_investment_cost'] * (investment_factor - salvage_factor) + \
+            (costs['total_om_cost'] + costs['generation_per_year'] * costs['fuel_cost']) * annuity_factor
+        lcoe = discounted_costs / (costs['generation_per_year'] * annuity_factor)
+        investment_cost = costs['total_investment_cost'] * investment_factor + \
+            self.grid_capacity_investment * costs['peak_load']
+
+        # If there are no people, nothing is built (the LCOE is still calculated with the div/0 protection)
+        def built(value):
+            return np.where(costs['no_people'], 0.0, value)
+
+        return LcoeResult(lcoe=lcoe,
+                          investment_cost=built(investment_cost),
+                          installed_capacity=built(costs['installed_capacity']),
+                          peak_load=built(costs['peak_load']),
+                          td_length=built(costs['td_length']))
+
+    def _get_lcoe_result_compiled(self, *args):
+        """
+        Runs get_lcoe_result through the compiled kernel, on the already broadcast input arrays.
+        """
+
+        # Copies, as Numba reading the writeable flag of a broadcast_arrays view gives a FutureWarning on every call
+        shape = args[0].shape
+        inputs = [np.array(arg, dtype=np.float64, order='C').ravel() for arg in args]
+        outputs = [np.empty(inputs[0].shape[0]) for _ in LcoeResult._fields]
+        investment_factor, salvage_factor, annuity_factor = self.get_discount_factors()
+
+        # All parameters are passed as floats, so that the kernel is only compiled once for all technologies
+        parameters = [float(value) for value in (
+            self.capacity_factor, self.distribution_losses, self.base_to_peak_load_ratio, self.grid_cell_area,
+            self.mv_line_capacity, self.lv_line_capacity, self.lv_line_max_length, self.mv_line_max_length,
+            self.hv_line_cost, self.mv_line_cost, self.lv_line_cost, self.hv_lv_transformer_cost,
+            self.mv_increase_rate, self.connection_cost_per_hh, self.om_of_td_lines, self.grid_price,
+            self.capital_cost, self.om_costs, self.diesel_price, self.diesel_truck_consumption,
+            self.diesel_truck_volume, self.efficiency, self.grid_capacity_investment,
+            investment_factor, salvage_factor, annuity_factor)]
+
+        with _lcoe_kernel_lock:
+            _lcoe_kernel(*inputs, *outputs,
+                         bool(self.grid_price > 0), bool(self.standalone), bool(self.diesel_price > 0), *parameters)
+
+        return LcoeResult(*[output.reshape(shape) for output in outputs])
+
+    def get_discount_factors(self):
+        """
+        Reduces the time-value part of the LCOE to three scalars, so that costs can be discounted with a multiply:
+
+        investment_factor multiplies the investment cost (year 0 and, if needed, the reinvestment year)
+        salvage_factor multiplies the investment cost for the discounted salvage value in the final year
+        annuity_factor multiplies the yearly O&M, fuel and generation (all years except the first)
+
+        They only depend on the start and end year, discount rate and technology life, so they are cached on the
+        instance and recalculated if any of these change (e.g. through a new config or set_default_values).
+        """
+
+        key = (self.start_year, self.end_year, self.discount_rate, self.tech_life)
+        cached_key, cached_factors = self._discount_factors
+        if cached_key == key:
+            return cached_factors
+
         project_life = self.end_year - self.start_year
         reinvest_year = 0
 
@@ -262,70 +1822,156 @@ class Technology:
         if self.tech_life < project_life:
             reinvest_year = self.tech_life
 
-        year = np.arange(project_life)
-        el_gen = generation_per_year * np.ones(project_life)
-        el_gen[0] = 0
-        discount_factor = (1 + self.discount_rate) ** year
-        investments = np.zeros(project_life)
-        investments[0] = total_investment_cost
-        if reinvest_year:
-            investments[reinvest_year] = total_investment_cost
-
-        salvage = np.zeros(project_life)
+        discount = 1 + self.discount_rate
+        investment_factor = 1.0
         used_life = project_life
         if reinvest_year:
+            investment_factor += discount ** -reinvest_year
             # so salvage will come from the remaining life after the re-investment
             used_life = project_life - self.tech_life
-        salvage[-1] = total_investment_cost * (1 - used_life / self.tech_life)
 
-        operation_and_maintenance = total_om_cost * np.ones(project_life)
-        operation_and_maintenance[0] = 0
-        fuel = el_gen * fuel_cost
-        fuel[0] = 0
+        salvage_factor = (1 - used_life / self.tech_life) * discount ** -(project_life - 1)
 
-        # So we also return the total investment cost for this number of people
-        if get_investment_cost:
-            discounted_investments = investments / discount_factor
-            return np.sum(discounted_investments) + self.grid_capacity_investment * peak_load
+        # Geometric series of the discount factors for years 1 to project_life - 1
+        if self.discount_rate == 0:
+            annuity_factor = project_life - 1
         else:
-            discounted_costs = (investments + operation_and_maintenance + fuel - salvage) / discount_factor
-            discounted_generation = el_gen / discount_factor
-            return np.sum(discounted_costs) / np.sum(discounted_generation)
+            annuity_factor = (1 - discount ** -(project_life - 1)) / self.discount_rate
+
+        factors = (investment_factor, salvage_factor, annuity_factor)
+        self._discount_factors = (key, factors)
+        return factors
+
+    def get_discount_factor_derivatives(self):
+        """
+        The derivatives of the three factors of get_discount_factors with respect to the discount rate, as used for
+        the discount rate sensitivity in get_lcoe_sensitivities.
+        """
+
+        project_life = self.end_year - self.start_year
+        reinvest_year = self.tech_life if self.tech_life < project_life else 0
+        used_life = project_life - self.tech_life if reinvest_year else project_life
+        discount = 1 + self.discount_rate
+
+        d_investment_factor = -reinvest_year * discount ** (-reinvest_year - 1) if reinvest_year else 0.0
+        d_salvage_factor = -(project_life - 1) * (1 - used_life / self.tech_life) * discount ** -project_life
+        # Term by term from the geometric series, which also holds for a zero discount rate
+        d_annuity_factor = -sum(year * discount ** (-year - 1) for year in range(1, project_life))
 
-    def get_grid_table(self, energy_per_hh, num_people_per_hh, max_dist):
+        return d_investment_factor, d_salvage_factor, d_annuity_factor
+
+    def get_grid_table(self, energy_per_hh, num_people_per_hh, max_dist, cache=None, people=None):
         """
-        Uses calc_lcoe to generate a 2D grid with the grid LCOEs, for faster access in teh electrification algorithm
+        Uses get_lcoe_batch to generate a 2D grid with the grid LCOEs, for faster access in the electrification
+        algorithm. All population and distance combinations are calculated in one broadcast call, and a GridTable is
+        returned (see GridLcoeTable for looking values up).
+
+        If a GridTableCache is given, the table is taken from it when possible, and otherwise added to it. people
+        gives the population bins (GridLcoeTable.people if None).
         """
 
+        # The electrification algorithm rounds off with the same scheme, in GridLcoeTable
+        people = GridLcoeTable.people if people is None else np.asarray(people)
+
+        if cache is not None:
+            key = cache.get_key(self, energy_per_hh, num_people_per_hh, max_dist, people)
+            grid_table = cache.load(key)
+            if grid_table is not None:
+                logging.info('Using the cached grid table for {} kWh/hh/year'.format(energy_per_hh))
+                return grid_table
+
         logging.info('Creating a grid table for {} kWh/hh/year'.format(energy_per_hh))
 
-        # Coarser resolution at the high end (just to catch the few places with exceptional population density)
-        # The electrification algorithm must round off with the same scheme
-        people_arr_direct = list(range(1000)) + list(range(1000, 10000, 10)) + list(range(10000, 350000, 1000))
-        elec_dists = range(0, int(max_dist) + 20)  # add twenty to handle edge cases
-        grid_lcoes = pd.DataFrame(index=elec_dists, columns=people_arr_direct)
+        distances = np.arange(0, int(max_dist) + 20)  # add twenty to handle edge cases
 
-        for people in people_arr_direct:
-            for additional_mv_line_length in elec_dists:
-                grid_lcoes[people][additional_mv_line_length] = self.get_lcoe(
-                    energy_per_hh=energy_per_hh,
-                    people=people,
-                    num_people_per_hh=num_people_per_hh,
-                    additional_mv_line_length=additional_mv_line_length)
+        lcoes = self.get_lcoe_batch(energy_per_hh=energy_per_hh,
+                                    people=people[:, None],
+                                    num_people_per_hh=num_people_per_hh,
+                                    additional_mv_line_length=distances[None, :])
 
-        return grid_lcoes.to_dict()
+        grid_table = GridTable(lcoes=lcoes, people=people, distances=distances, grid_price=self.grid_price)
+        if cache is not None:
+            cache.save(key, grid_table)
+        return grid_table
 
 
 class SettlementProcessor:
     """
     Processes the dataframe and adds all the columns to determine the cheapest option and the final costs and summaries
     """
-    def __init__(self, path):
-        try:
-            self.df = pd.read_csv(path)
-        except FileNotFoundError:
-            print('You need to first split into a base directory and prep!')
-            raise
+    def __init__(self, path=None, lcoe_dtype=np.float64, df=None, sensitivities=False, deduplicate=False,
+                 quantization=None, columns=None, compact=False):
+        """
+        Reads the settlements from path, or takes an already loaded df (e.g. a copy of one loaded settlements df for
+        each of several scenarios running at the same time)
+
+        The file format is chosen by the extension (see read_settlements), and columns optionally limits the columns
+        read, e.g. to SCENARIO_COLUMNS when running a scenario from a prepped file. The results are then written with
+        write_settlements(..., base=path) to keep the other columns of the file in them.
+
+        With sensitivities, the derivatives of the LCOEs with respect to the main drivers are calculated along with
+        the LCOEs (see Technology.get_lcoe_sensitivities), and added as columns for the minimum overall technology.
+
+        With deduplicate, the LCOEs are calculated once for each unique combination of inputs and copied to all
+        settlements sharing it. This only pays off where many settlements share their inputs exactly, so quantization
+        optionally rounds inputs to a relative step first (in log scale, so that e.g. a few people keep their
+        precision), as a dict from the Technology.get_lcoe_result argument to the step (e.g. DEDUP_QUANTIZATION), so
+        that more settlements share a combination, at the cost of calculating them with the rounded values.
+
+        With compact, the df is kept in the compact dtypes of SETTLEMENT_SCHEMA (see apply_settlement_schema), with
+        the columns added by each step compacted at its end, and the LCOEs are float32, for large countries that
+        don't otherwise fit in memory. The calculations are still done in float64 from the rounded inputs, so the
+        LCOEs and results change by no more than a relative 1e-6 (3e-6 for the wind capacity factors, which are steep
+        in the wind speed), and the technology chosen only where two LCOEs are that close.
+        """
+
+        self.compact = compact
+        if df is not None:
+            self.df = df
+            self.compact_columns()
+        else:
+            try:
+                self.df = read_settlements(path, columns, compact)
+            except FileNotFoundError:
+                print('You need to first split into a base directory and prep!')
+                raise
+
+        # The LcoeResult of the minimum off-grid technology of each settlement (with the index of that technology in
+        # TECHNOLOGIES, and whether it was calculated there rather than left out by its mask), and of the technology
+        # with the minimum overall LCOE, as found by calculate_off_grid_lcoes and results_columns. The minimum overall
+        # is either the grid or the minimum off-grid technology, so the other technologies' results aren't kept
+        self.min_offgrid_results = None
+        self.min_overall_results = None
+
+        # The LCOEs of all technologies as one (settlements x technologies) array, with the columns in the order of
+        # TECHNOLOGIES, the per technology columns are only added to the df at the end in results_columns
+        self.lcoe_dtype = np.float32 if compact else lcoe_dtype
+        self.lcoes = None
+
+        # An LcoeSensitivities with a (settlements x technologies) array per driver, like lcoes (zero where a
+        # technology isn't an option)
+        self.sensitivities = sensitivities
+        self.lcoe_sensitivities = None
+
+        # The number of settlements and of unique input combinations for each deduplicated LCOE calculation
+        self.deduplicate = deduplicate
+        self.quantization = quantization or {}
+        self.dedup_stats = []
+
+        # Whether the grid LCOEs of run_elec were interpolated at the continuous MinGridDist (rather than looked up at
+        # the whole km below it)
+        self.grid_interpolate = False
+
+    def compact_columns(self):
+        """
+        Gives the columns of the df their compact dtypes in compact mode (and does nothing otherwise)
+        """
+
+        if self.compact:
+            apply_settlement_schema(self.df, compact=True)
+            for tech in TECHNOLOGIES:
+                if tech.name in self.df and self.df[tech.name].dtype != self.lcoe_dtype:
+                    self.df[tech.name] = self.df[tech.name].astype(self.lcoe_dtype)
 
     def condition_df(self):
         """
@@ -333,22 +1979,16 @@ class SettlementProcessor:
         """
 
         logging.info('Ensure that columns that are supposed to be numeric are numeric')
-        self.df[SET_GHI] = pd.to_numeric(self.df[SET_GHI], errors='coerce')
-        self.df[SET_WINDVEL] = pd.to_numeric(self.df[SET_WINDVEL], errors='coerce')
-        self.df[SET_NIGHT_LIGHTS] = pd.to_numeric(self.df[SET_NIGHT_LIGHTS], errors='coerce')
-        self.df[SET_ELEVATION] = pd.to_numeric(self.df[SET_ELEVATION], errors='coerce')
-        self.df[SET_SLOPE] = pd.to_numeric(self.df[SET_SLOPE], errors='coerce')
-        self.df[SET_LAND_COVER] = pd.to_numeric(self.df[SET_LAND_COVER], errors='coerce')
-        self.df[SET_GRID_DIST_CURRENT] = pd.to_numeric(self.df[SET_GRID_DIST_CURRENT], errors='coerce')
-        self.df[SET_GRID_DIST_PLANNED] = pd.to_numeric(self.df[SET_GRID_DIST_PLANNED], errors='coerce')
-        self.df[SET_SUBSTATION_DIST] = pd.to_numeric(self.df[SET_SUBSTATION_DIST], errors='coerce')
-        self.df[SET_ROAD_DIST] = pd.to_numeric(self.df[SET_ROAD_DIST], errors='coerce')
-        self.df[SET_HYDRO_DIST] = pd.to_numeric(self.df[SET_HYDRO_DIST], errors='coerce')
-        self.df[SET_HYDRO] = pd.to_numeric(self.df[SET_HYDRO], errors='coerce')
-        self.df[SET_SOLAR_RESTRICTION] = pd.to_numeric(self.df[SET_SOLAR_RESTRICTION], errors='coerce')
+        apply_settlement_schema(self.df, self.compact)  # a check only, when the df was read with read_settlements
 
         logging.info('Replace null values with zero')
-        self.df.fillna(0, inplace=True)
+        others = [column for column in self.df.columns
+                  if column not in SETTLEMENT_SCHEMA and self.df[column].hasnans]
+        if others:
+            self.df[others] = self.df[others].fillna(0)
+        for column in self.df.columns:
+            if column in SETTLEMENT_SCHEMA and SETTLEMENT_SCHEMA[column].nulls == 'keep' and self.df[column].hasnans:
+                logging.info('{} nulls kept in {} (not given)'.format(self.df[column].isna().sum(), column))
 
         logging.info('Sort by country, Y and X')
         self.df.sort_values(by=[SET_COUNTRY, SET_Y, SET_X], inplace=True)
@@ -367,6 +2007,8 @@ class SettlementProcessor:
         self.df[SET_X_DEG] = self.df.apply(get_x, axis=1)
         self.df[SET_Y_DEG] = self.df.apply(get_y, axis=1)
 
+        self.compact_columns()
+
     def grid_penalties(self):
         """
         Add a grid penalty factor to increase the grid cost in areas that higher road distance, higher substation
@@ -491,6 +2133,8 @@ class SettlementProcessor:
         logging.info('Grid penalty')
         self.df[SET_GRID_PENALTY] = self.df.apply(set_penalty, axis=1)
 
+        self.compact_columns()
+
     def calc_wind_cfs(self):
         """
         Calculate the wind capacity factor based on the average wind velocity.
@@ -525,6 +2169,8 @@ class SettlementProcessor:
         logging.info('Calculate Wind CF')
         self.df[SET_WINDCF] = self.df.apply(get_wind_cf, axis=1)
 
+        self.compact_columns()
+
     def calibrate_pop_and_urban(self, pop_actual, pop_future, urban, urban_future, urban_cutoff):
         """
         Calibrate the actual current population, the urban split and forecast the future population
@@ -601,6 +2247,8 @@ class SettlementProcessor:
                                                 else row[SET_POP_CALIB] * rural_growth,
                                                 axis=1)
 
+        self.compact_columns()
+
         return urban_cutoff, urban_modelled
 
     def elec_current_and_future(self, elec_actual, pop_cutoff, min_night_lights, max_grid_dist,
@@ -708,6 +2356,8 @@ class SettlementProcessor:
         self.df.loc[self.df[SET_ELEC_CURRENT] == 0, SET_NEW_CONNECTIONS] = self.df[SET_POP_FUTURE]
         self.df.loc[self.df[SET_NEW_CONNECTIONS] < 0, SET_NEW_CONNECTIONS] = 0
 
+        self.compact_columns()
+
         return min_night_lights, max_grid_dist, max_road_dist, elec_modelled, pop_cutoff, pop_cutoff2
 
     @staticmethod
@@ -764,117 +2414,108 @@ class SettlementProcessor:
 
         return unelec_list
 
-    def pre_elec(self, grid_lcoes_rural, grid_lcoes_urban, pre_elec_dist):
+    def pre_elec(self, grid_lcoes, pre_elec_dist, grid_prices=None):
         """
         Determine which settlements are economically close to existing or planned grid lines, and should be
         considered electrified in the electrification algorithm
-        """
-
-        df_neargrid = self.df.loc[self.df[SET_GRID_DIST_PLANNED] < pre_elec_dist]
 
-        pop = df_neargrid[SET_POP_FUTURE].tolist()
-        urban = df_neargrid[SET_URBAN].tolist()
-        grid_penalty_ratio = df_neargrid[SET_GRID_PENALTY].tolist()
-        status = df_neargrid[SET_ELEC_CURRENT].tolist()
-        min_tech_lcoes = df_neargrid[SET_MIN_OFFGRID_LCOE].tolist()
-        dist_planned = df_neargrid[SET_GRID_DIST_PLANNED].tolist()
-
-        electrified, unelectrified = self.separate_elec_status(status)
+        grid_prices optionally gives the grid price for each settlement (see get_grid_prices).
+        """
 
-        for unelec in unelectrified:
+        near_grid = (self.df[SET_GRID_DIST_PLANNED] < pre_elec_dist).values
+        df_neargrid = self.df.loc[near_grid]
 
-            pop_index = pop[unelec]
-            if pop_index < 1000:
-                pop_index = int(pop_index)
-            elif pop_index < 10000:
-                pop_index = 10 * round(pop_index / 10)
-            else:
-                pop_index = 1000 * round(pop_index / 1000)
+        status = df_neargrid[SET_ELEC_CURRENT].values.copy()
+        unelectrified = np.flatnonzero(status == 0)
 
-            if urban[unelec]:
-                grid_lcoe = grid_lcoes_urban[pop_index][int(grid_penalty_ratio[unelec] * dist_planned[unelec])]
-            else:
-                grid_lcoe = grid_lcoes_rural[pop_index][int(grid_penalty_ratio[unelec] * dist_planned[unelec])]
-
-            if grid_lcoe < min_tech_lcoes[unelec]:
-                status[unelec] = 1
+        grid_lcoe = grid_lcoes.lookup(df_neargrid[SET_POP_FUTURE].values[unelectrified],
+                                      (df_neargrid[SET_GRID_PENALTY] * df_neargrid[SET_GRID_DIST_PLANNED]).values[
+                                          unelectrified],
+                                      df_neargrid[SET_URBAN].values[unelectrified],
+                                      None if grid_prices is None else grid_prices[near_grid][unelectrified],
+                                      df_neargrid[SET_ENERGY_PER_HH].values[unelectrified])
+        status[unelectrified[grid_lcoe < df_neargrid[SET_MIN_OFFGRID_LCOE].values[unelectrified]]] = 1
 
         return status
 
-    def elec_extension(self, grid_lcoes_rural, grid_lcoes_urban, existing_grid_cost_ratio, max_dist):
+    def elec_extension(self, grid_lcoes, existing_grid_cost_ratio, max_dist, grid_prices=None):
         """
         Iterate through all electrified settlements and find which settlements can be economically connected to the grid
         Repeat with newly electrified settlements until no more are added
+
+        The grid LCOEs of all candidate connections in a loop are looked up at once. Where several electrified
+        settlements can connect the same settlement, the first one with the lowest LCOE is used. grid_prices optionally
+        gives the grid price for each settlement (see get_grid_prices).
+
+        Whether the grid beats the off-grid options is decided by distance alone, against the maximum viable
+        distance of each settlement from GridLcoeTable.max_viable_dist. Settlements where that is zero can never be
+        connected and are left out before any search.
         """
 
-        x = self.df[SET_X].tolist()
-        y = self.df[SET_Y].tolist()
-        pop = self.df[SET_POP_FUTURE].tolist()
-        urban = self.df[SET_URBAN].tolist()
-        grid_penalty_ratio = self.df[SET_GRID_PENALTY].tolist()
+        def lookup(rows, dist):
+            return grid_lcoes.lookup(pop[rows], dist, urban[rows], None if grid_prices is None else grid_prices[rows],
+                                     energy_per_hh[rows])
+
+        x = self.df[SET_X].values.astype(float)
+        y = self.df[SET_Y].values.astype(float)
+        pop = self.df[SET_POP_FUTURE].values
+        urban = self.df[SET_URBAN].values
+        energy_per_hh = self.df[SET_ENERGY_PER_HH].values
+        grid_penalty_ratio = self.df[SET_GRID_PENALTY].values
         status = self.df[SET_ELEC_FUTURE].tolist()
-        min_tech_lcoes = self.df[SET_MIN_OFFGRID_LCOE].tolist()
-        new_lcoes = self.df[SET_LCOE_GRID].tolist()
+        min_tech_lcoes = self.df[SET_MIN_OFFGRID_LCOE].values
+        new_lcoes = self.df[SET_LCOE_GRID].values.astype(float)
 
-        cell_path_real = list(np.zeros(len(status)).tolist())
-        cell_path_adjusted = list(np.zeros(len(status)).tolist())
+        cell_path_real = np.zeros(len(status))
+        cell_path_adjusted = np.zeros(len(status))
         electrified, unelectrified = self.separate_elec_status(status)
 
-        loops=0
         logging.info('Initially {} cells electrified'.format(len(electrified)))
 
-        close = []
-        elec_nodes2 = []
-        changes = []
-        for elec in electrified:
-            elec_nodes2.append((x[elec], y[elec]))
-        elec_nodes2 = np.asarray(elec_nodes2)
-
-        def closest_elec(unelec_node, elec_nodes):
-            deltas = elec_nodes - unelec_node
-            dist_2 = np.einsum('ij,ij->i', deltas, deltas)
-            return np.argmin(dist_2)
-
-        for unelec in unelectrified:
-            pop_index = pop[unelec]
-            if pop_index < 1000:
-                pop_index = int(pop_index)
-            elif pop_index < 10000:
-                pop_index = 10 * round(pop_index / 10)
-            else:
-                pop_index = 1000 * round(pop_index / 1000)
-
-            if urban[unelec]:
-                grid_lcoe = grid_lcoes_urban[pop_index][1]
-            else:
-                grid_lcoe = grid_lcoes_rural[pop_index][1]
-            if grid_lcoe <= min_tech_lcoes[unelec]:
-                node = (x[unelec], y[unelec])
-                closest_elec_node = closest_elec(node, elec_nodes2)
-                dist = sqrt((x[electrified[closest_elec_node]] - x[unelec]) ** 2 + (y[electrified[closest_elec_node]] - y[unelec]) ** 2)
-                if dist <= max_dist:
-                    dist_adjusted = grid_penalty_ratio[unelec] * dist
-                    if dist_adjusted < max_dist:
-                        if urban[unelec]:
-                            grid_lcoe = grid_lcoes_urban[pop_index][int(dist_adjusted)]
-                        else:
-                            grid_lcoe = grid_lcoes_rural[pop_index][int(dist_adjusted)]
-
-                        if grid_lcoe < min_tech_lcoes[unelec]:
-                            if grid_lcoe < new_lcoes[unelec]:
-                                new_lcoes[unelec] = grid_lcoe
-                                cell_path_real[unelec] = dist
-                                cell_path_adjusted[unelec] = dist_adjusted
-                                if unelec not in changes:
-                                    changes.append(unelec)
-                            else:
-                                close.append(unelec)
-                        else:
-                            close.append(unelec)
-                    else:
-                        close.append(unelec)
-        electrified = changes[:]
-        unelectrified = close
+        elec_nodes2 = np.asarray([(x[elec], y[elec]) for elec in electrified])
+
+        def closest_elec(unelec_nodes, elec_nodes):
+            # In chunks, so that the (nodes x electrified) distance matrix stays small
+            closest = np.empty(len(unelec_nodes), dtype=int)
+            chunk = max(1, 10 ** 7 // max(1, len(elec_nodes)))
+            for start in range(0, len(unelec_nodes), chunk):
+                deltas = elec_nodes[None, :, :] - unelec_nodes[start:start + chunk, None, :]
+                dist_2 = np.einsum('cij,cij->ci', deltas, deltas)
+                closest[start:start + chunk] = np.argmin(dist_2, axis=1)
+            return closest
+
+        # Only the settlements where the grid can beat the off-grid options at the shortest distance are considered
+        unelectrified = np.asarray(unelectrified, dtype=int)
+        max_viable_dist = np.zeros(len(status))
+        max_viable_dist[unelectrified] = grid_lcoes.max_viable_dist(
+            pop[unelectrified], urban[unelectrified], min_tech_lcoes[unelectrified],
+            None if grid_prices is None else grid_prices[unelectrified], energy_per_hh[unelectrified])
+        candidates = unelectrified[(max_viable_dist[unelectrified] > 0) &
+                                   (lookup(unelectrified, 1) <= min_tech_lcoes[unelectrified])]
+        logging.info('{} of {} unelectrified cells can be connected to the grid'.format(len(candidates),
+                                                                                        len(unelectrified)))
+
+        closest = np.asarray(electrified, dtype=int)[
+            closest_elec(np.column_stack([x[candidates], y[candidates]]), elec_nodes2)] if len(candidates) else \
+            np.zeros(0, dtype=int)
+        dist = np.sqrt((x[closest] - x[candidates]) ** 2 + (y[closest] - y[candidates]) ** 2)
+
+        close = dist <= max_dist
+        candidates, dist = candidates[close], dist[close]
+        dist_adjusted = grid_penalty_ratio[candidates] * dist
+
+        grid_lcoe = np.full(len(candidates), np.inf)
+        viable = (dist_adjusted < max_dist) & (dist_adjusted < max_viable_dist[candidates])
+        grid_lcoe[viable] = lookup(candidates[viable], dist_adjusted[viable])
+
+        connect = viable & (grid_lcoe < new_lcoes[candidates])
+        connected = candidates[connect]
+        new_lcoes[connected] = grid_lcoe[connect]
+        cell_path_real[connected] = dist[connect]
+        cell_path_adjusted[connected] = dist_adjusted[connect]
+
+        electrified = connected.tolist()
+        unelectrified = candidates[~connect].tolist()
 
         loops = 1
         while len(electrified) > 0:
@@ -882,66 +2523,103 @@ class SettlementProcessor:
             loops += 1
             hash_table = self.get_2d_hash_table(x, y, unelectrified, max_dist)
 
-            changes = []
+            elec_rows = []
+            unelec_rows = []
             for elec in electrified:
                 unelectrified_hashed = self.get_unelectrified_rows(hash_table, elec, x, y, max_dist)
-                for unelec in unelectrified_hashed:
-                    prev_dist = cell_path_real[elec]
-                    dist = sqrt((x[elec] - x[unelec]) ** 2 + (y[elec] - y[unelec]) ** 2)
-                    if prev_dist + dist < max_dist:
-                        pop_index = pop[unelec]
-                        if pop_index < 1000:
-                            pop_index = int(pop_index)
-                        elif pop_index < 10000:
-                            pop_index = 10 * round(pop_index / 10)
-                        else:
-                            pop_index = 1000 * round(pop_index / 1000)
-
-                        dist_adjusted = grid_penalty_ratio[unelec]*(dist + existing_grid_cost_ratio * prev_dist)
-
-                        if urban[unelec]:
-                            grid_lcoe = grid_lcoes_urban[pop_index][int(dist_adjusted)]
-                        else:
-                            grid_lcoe = grid_lcoes_rural[pop_index][int(dist_adjusted)]
-
-                        if grid_lcoe < min_tech_lcoes[unelec]:
-                            if grid_lcoe < new_lcoes[unelec]:
-                                new_lcoes[unelec] = grid_lcoe
-                                cell_path_real[unelec] = dist + prev_dist
-                                cell_path_adjusted[unelec] = dist_adjusted
-                                if unelec not in changes:
-                                    changes.append(unelec)
-
-            electrified = changes[:]
-            unelectrified = [x for x in unelectrified if x not in electrified]
+                unelec_rows.extend(unelectrified_hashed)
+                elec_rows.extend([elec] * len(unelectrified_hashed))
+            elec_rows = np.asarray(elec_rows, dtype=int)
+            unelec_rows = np.asarray(unelec_rows, dtype=int)
+
+            prev_dist = cell_path_real[elec_rows]
+            dist = np.sqrt((x[elec_rows] - x[unelec_rows]) ** 2 + (y[elec_rows] - y[unelec_rows]) ** 2)
+            near = prev_dist + dist < max_dist
+            elec_rows, unelec_rows, prev_dist, dist = elec_rows[near], unelec_rows[near], prev_dist[near], dist[near]
+
+            dist_adjusted = grid_penalty_ratio[unelec_rows] * (dist + existing_grid_cost_ratio * prev_dist)
+            viable = dist_adjusted < max_viable_dist[unelec_rows]
+            unelec_rows, prev_dist, dist, dist_adjusted = \
+                unelec_rows[viable], prev_dist[viable], dist[viable], dist_adjusted[viable]
+            grid_lcoe = lookup(unelec_rows, dist_adjusted)
+
+            better = grid_lcoe < new_lcoes[unelec_rows]
+            unelec_rows, prev_dist, dist, dist_adjusted, grid_lcoe = \
+                unelec_rows[better], prev_dist[better], dist[better], dist_adjusted[better], grid_lcoe[better]
+
+            # The connection of each settlement is its first candidate with the lowest LCOE (lexsort is stable)
+            order = np.lexsort((grid_lcoe, unelec_rows))
+            first_in_group = np.ones(len(order), dtype=bool)
+            first_in_group[1:] = unelec_rows[order][1:] != unelec_rows[order][:-1]
+            best = order[first_in_group]
+
+            new_lcoes[unelec_rows[best]] = grid_lcoe[best]
+            cell_path_real[unelec_rows[best]] = dist[best] + prev_dist[best]
+            cell_path_adjusted[unelec_rows[best]] = dist_adjusted[best]
+
+            # Newly electrified settlements, in the order they were first reached
+            _, first_reached = np.unique(unelec_rows, return_index=True)
+            electrified = unelec_rows[np.sort(first_reached)].tolist()
+            electrified_set = set(electrified)
+            unelectrified = [row for row in unelectrified if row not in electrified_set]
 
         return new_lcoes, cell_path_adjusted
 
-    def run_elec(self, grid_lcoes_rural, grid_lcoes_urban, grid_price, existing_grid_cost_ratio, max_dist):
+    def get_grid_table_settlements(self):
+        """
+        The populations of the settlements the electrification algorithm looks grid LCOEs up for (the ones not
+        electrified to begin with), and whether they are urban, for building only the grid table bins they need.
+        """
+
+        unelectrified = self.df[SET_ELEC_CURRENT] == 0
+        return self.df.loc[unelectrified, SET_POP_FUTURE].values, self.df.loc[unelectrified, SET_URBAN].values == 1
+
+    def get_grid_prices(self, grid_price):
+        """
+        The grid price for each settlement: from the GridPrice column where it's given, otherwise grid_price.
+        """
+
+        if SET_GRID_PRICE not in self.df:
+            return np.full(len(self.df), float(grid_price))
+        return self.df[SET_GRID_PRICE].fillna(grid_price).values.astype(float)
+
+    def run_elec(self, grid_lcoes, grid_price, existing_grid_cost_ratio, max_dist):
         """
-        Runs the pre-elec and grid extension algorithms
+        Runs the pre-elec and grid extension algorithms, with the grid LCOEs from a GridLcoeTable (or a
+        DemandGridLcoeTable where the energy demand varies by settlement)
+
+        A GridPrice column in the df overrides grid_price for those settlements (e.g. for regional tariffs).
         """
 
+        grid_prices = self.get_grid_prices(grid_price)
+        self.grid_interpolate = grid_lcoes.interpolate
+
         # Calculate 2030 pre-electrification
         logging.info('Determine future pre-electrification status')
         self.df[SET_ELEC_FUTURE] = self.df.apply(lambda row: 1 if row[SET_ELEC_CURRENT] == 1 else 0, axis=1)
 
         pre_elec_dist = 10  # The maximum distance from the grid in km to pre-electrifiy settlements
-        self.df.loc[self.df[SET_GRID_DIST_PLANNED] < pre_elec_dist, SET_ELEC_FUTURE] = self.pre_elec(grid_lcoes_rural,
-                                                                                                     grid_lcoes_urban,
-                                                                                                     pre_elec_dist)
+        self.df.loc[self.df[SET_GRID_DIST_PLANNED] < pre_elec_dist, SET_ELEC_FUTURE] = self.pre_elec(grid_lcoes,
+                                                                                                     pre_elec_dist,
+                                                                                                     grid_prices)
 
         self.df[SET_LCOE_GRID] = 99
-        self.df[SET_LCOE_GRID] = self.df.apply(lambda row: grid_price if row[SET_ELEC_FUTURE] == 1 else 99, axis=1)
+        self.df[SET_LCOE_GRID] = np.where(self.df[SET_ELEC_FUTURE] == 1, grid_prices, 99)
 
-        self.df[SET_LCOE_GRID], self.df[SET_MIN_GRID_DIST] = self.elec_extension(grid_lcoes_rural, grid_lcoes_urban,
-                                                                                 existing_grid_cost_ratio, max_dist)
+        self.df[SET_LCOE_GRID], self.df[SET_MIN_GRID_DIST] = self.elec_extension(grid_lcoes,
+                                                                                 existing_grid_cost_ratio, max_dist,
+                                                                                 grid_prices)
+
+        self.compact_columns()
 
     def set_scenario_variables(self, energy_per_hh_rural, energy_per_hh_urban,
                                num_people_per_hh_rural, num_people_per_hh_urban):
         """
         Set the basic scenario parameters that differ based on urban/rural
         So that they are in the table and can be read directly to calculate LCOEs
+
+        Where the df has an EnergyPerPerson demand layer, it replaces the urban/rural demand of those settlements
+        (the grid LCOEs then need a DemandGridLcoeTable)
         """
 
         logging.info('Setting electrification targets')
@@ -951,201 +2629,335 @@ class SettlementProcessor:
         self.df.loc[self.df[SET_URBAN] == 0, SET_NUM_PEOPLE_PER_HH] = num_people_per_hh_rural
         self.df.loc[self.df[SET_URBAN] == 1, SET_NUM_PEOPLE_PER_HH] = num_people_per_hh_urban
 
-    def calculate_off_grid_lcoes(self, mg_hydro_calc, mg_wind_calc, mg_pv_calc,
-                                 sa_pv_calc, mg_diesel_calc, sa_diesel_calc):
+        if SET_ENERGY_PER_PERSON in self.df:
+            energy_per_hh = self.df[SET_ENERGY_PER_PERSON] * self.df[SET_NUM_PEOPLE_PER_HH]
+            self.df[SET_ENERGY_PER_HH] = energy_per_hh.fillna(self.df[SET_ENERGY_PER_HH])
+
+        self.compact_columns()
+
+    def get_lcoe_results(self, calc, mask=None, sensitivities=False, **kwargs):
         """
-        Calcuate the LCOEs for all off-grid technologies, and calculate the minimum, so that the electrification
-        algorithm knows where the bar is before it becomes economical to electrify
+        Calculates the LcoeResult of one technology for all settlements in one vectorized call.
+
+        Only the settlements in mask (all if None) are calculated, the others get an LCOE of 99 and zero for the rest.
+        Any extra keyword arguments are passed on to Technology.get_lcoe_result, as columns or scalars.
+        With sensitivities, a tuple of the LcoeResult and the LcoeSensitivities (zero outside the mask) is returned.
+        """
+
+        mask = np.ones(len(self.df), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        result = LcoeResult(*[np.full(len(self.df), 99.0 if field == 'lcoe' else 0.0)
+                              for field in LcoeResult._fields])
+        derivatives = LcoeSensitivities(*[np.zeros(len(self.df)) for _ in LcoeSensitivities._fields])
+        if not mask.any():
+            return (result, derivatives) if sensitivities else result
+
+        def select(value):
+            return np.asarray(value, dtype=float)[mask] if np.ndim(value) else value
+
+        kwargs = {key: select(value) for key, value in kwargs.items()}
+        kwargs.update(energy_per_hh=select(self.df[SET_ENERGY_PER_HH]),
+                      people=select(self.df[SET_POP_FUTURE]),
+                      num_people_per_hh=select(self.df[SET_NUM_PEOPLE_PER_HH]))
+
+        inverse = slice(None)
+        if self.deduplicate:
+            kwargs, inverse = self.get_unique_inputs(kwargs)
+
+        if sensitivities:
+            calculated, calculated_derivatives = calc.get_lcoe_sensitivities(**kwargs)
+            for full, part in zip(derivatives, calculated_derivatives):
+                full[mask] = part[inverse]
+        else:
+            calculated = calc.get_lcoe_result(**kwargs)
+        for full, part in zip(result, calculated):
+            full[mask] = part[inverse]
+        return (result, derivatives) if sensitivities else result
+
+    def get_unique_inputs(self, kwargs):
         """
+        Reduces the column inputs for Technology.get_lcoe_result to their unique combinations (after the rounding in
+        quantization), returning the reduced inputs and the index of each settlement's combination in them.
+        """
+
+        columns = [key for key, value in kwargs.items() if np.ndim(value)]
+        values = np.column_stack([np.broadcast_to(kwargs[key], np.shape(kwargs['people'])) for key in columns])
+        for j, key in enumerate(columns):
+            if key in self.quantization:
+                # Zero (e.g. a settlement without people) and negative values are kept as they are
+                step = self.quantization[key]
+                positive = values[:, j] > 0
+                values[positive, j] = np.exp(np.round(np.log(values[positive, j]) / step) * step)
+
+        # Each row's combination as one code, combining the codes of the columns factorized by hashing (much faster
+        # than sorting the rows with np.unique), with the codes re-factorized after each column to keep them small
+        inverse = np.zeros(len(values), dtype=np.int64)
+        for j in range(len(columns)):
+            codes, uniques = pd.factorize(values[:, j])
+            codes = np.where(codes < 0, len(uniques), codes)  # nulls get a code of their own
+            inverse, combinations = pd.factorize(inverse * (len(uniques) + 1) + codes)
+        # The first settlement with each combination gives its values
+        first = np.empty(len(combinations), dtype=np.int64)
+        first[inverse[::-1]] = np.arange(len(values) - 1, -1, -1)
+        unique_values = values[first]
+
+        self.dedup_stats.append((len(values), len(unique_values)))
+        logging.info('{} unique input combinations for {} settlements (dedup ratio {:.2f})'.format(
+            len(unique_values), len(values), len(values) / len(unique_values)))
+
+        unique_kwargs = dict(kwargs)
+        unique_kwargs.update({key: unique_values[:, j] for j, key in enumerate(columns)})
+        return unique_kwargs, inverse
+
+    def get_dedup_ratio(self):
+        """
+        The number of settlements over the number of unique input combinations, over all deduplicated calculations
+        so far (1 if nothing was deduplicated).
+        """
+
+        settlements = sum(count for count, _ in self.dedup_stats)
+        unique = sum(count for _, count in self.dedup_stats)
+        return settlements / unique if unique else 1.0
 
-        # A df with all hydropower sites, to ensure that they aren't assigned more capacity than is available
-        hydro_used = 'HydropowerUsed'  # the amount of the hydro potential that has been assigned
-        hydro_df = self.df[[SET_HYDRO_FID, SET_HYDRO]].drop_duplicates(subset=SET_HYDRO_FID)
-        hydro_df[hydro_used] = 0
-        hydro_df = hydro_df.set_index(SET_HYDRO_FID)
+    def get_tech_inputs(self, tech):
+        """
+        Returns the keyword arguments for Technology.get_lcoe_result from a TechnologySpec, as columns of the df.
+        """
 
-        max_hydro_dist = 5  # the max distance in km to consider hydropower viable
+        kwargs = tech.inputs(self.df) if tech.inputs else {}
+        if tech.capacity_factor:
+            kwargs['capacity_factor'] = tech.capacity_factor(self.df)
+        return kwargs
 
-        def hydro_lcoe(row):
-            if row[SET_HYDRO_DIST] < max_hydro_dist:
-                # calculate the capacity that would be added by the settlement
-                additional_capacity = ((row[SET_NEW_CONNECTIONS] * row[SET_ENERGY_PER_HH] / row[SET_NUM_PEOPLE_PER_HH])
-                                       / (HOURS_PER_YEAR * mg_hydro_calc.capacity_factor *
-                                          mg_hydro_calc.base_to_peak_load_ratio))
+    @staticmethod
+    def get_calcs(mg_hydro_calc, mg_wind_calc, mg_pv_calc, sa_pv_calc, mg_diesel_calc, sa_diesel_calc,
+                  grid_calc=None, **other_calcs):
+        """
+        Collects the Technology for each registered technology, by name.
+        """
 
-                # and add it to the tracking df
-                hydro_df.loc[row[SET_HYDRO_FID], hydro_used] += additional_capacity
+        calcs = {SET_LCOE_MG_HYDRO: mg_hydro_calc, SET_LCOE_MG_WIND: mg_wind_calc, SET_LCOE_MG_PV: mg_pv_calc,
+                 SET_LCOE_SA_PV: sa_pv_calc, SET_LCOE_MG_DIESEL: mg_diesel_calc, SET_LCOE_SA_DIESEL: sa_diesel_calc,
+                 SET_LCOE_GRID: grid_calc}
+        calcs.update(other_calcs)
 
-                # if it exceeds the available capacity, it's not an option
-                if hydro_df.loc[row[SET_HYDRO_FID], hydro_used] > hydro_df.loc[row[SET_HYDRO_FID], SET_HYDRO]:
-                    return 99
+        for tech in TECHNOLOGIES:
+            if calcs.get(tech.name) is None and (tech.category != 'Grid' or grid_calc is not None):
+                raise ValueError('No Technology has been given for {}'.format(tech.name))
+        return calcs
 
-                else:
-                    return mg_hydro_calc.get_lcoe(energy_per_hh=row[SET_ENERGY_PER_HH],
-                                                  people=row[SET_POP_FUTURE],
-                                                  num_people_per_hh=row[SET_NUM_PEOPLE_PER_HH],
-                                                  mv_line_length=row[SET_HYDRO_DIST])
+    def calculate_off_grid_lcoes(self, mg_hydro_calc, mg_wind_calc, mg_pv_calc,
+                                 sa_pv_calc, mg_diesel_calc, sa_diesel_calc, **other_calcs):
+        """
+        Calcuate the LCOEs for all off-grid technologies, and calculate the minimum, so that the electrification
+        algorithm knows where the bar is before it becomes economical to electrify
+
+        The Technology for any other registered technology is passed by name in other_calcs.
+        """
+
+        calcs = self.get_calcs(mg_hydro_calc, mg_wind_calc, mg_pv_calc, sa_pv_calc, mg_diesel_calc, sa_diesel_calc,
+                               **other_calcs)
+        self.lcoes = np.full((len(self.df), len(TECHNOLOGIES)), 99, dtype=self.lcoe_dtype)
+        if self.sensitivities:
+            self.lcoe_sensitivities = LcoeSensitivities(*[np.zeros((len(self.df), len(TECHNOLOGIES)))
+                                                          for _ in LcoeSensitivities._fields])
+
+        # The results of the minimum off-grid technology so far, replaced where a technology has a lower LCOE (as in
+        # self.lcoes, so that ties go to the first technology as with argmin)
+        min_offgrid_tech = np.full(len(self.df), -1)
+        min_offgrid_calculated = np.zeros(len(self.df), dtype=bool)
+        min_offgrid_result = LcoeResult(*[np.zeros(len(self.df)) for _ in LcoeResult._fields])
+
+        for i, tech in enumerate(TECHNOLOGIES):
+            if tech.category == 'Grid':
+                continue
+
+            logging.info('Calculate {} LCOE'.format(tech.name))
+            calc = calcs[tech.name]
+            if tech.eligible is None:
+                mask = np.ones(len(self.df), dtype=bool)
+            else:
+                mask = np.asarray(tech.eligible(self.df, calc), dtype=bool)
+
+            # Keep the full results of the minimum, so that the investment of the winning technology doesn't need
+            # recalculating
+            if self.sensitivities:
+                result, derivatives = self.get_lcoe_results(calc, mask, sensitivities=True,
+                                                            **self.get_tech_inputs(tech))
+                for full, part in zip(self.lcoe_sensitivities, derivatives):
+                    full[:, i] = part
             else:
-                return 99
-
-        logging.info('Calculate minigrid hydro LCOE')
-        self.df[SET_LCOE_MG_HYDRO] = self.df.apply(hydro_lcoe, axis=1)
-
-        num_hydro_limited = hydro_df.loc[hydro_df[hydro_used] > hydro_df[SET_HYDRO]][SET_HYDRO].count()
-        logging.info('{} potential hydropower sites were utilised to maximum capacity'.format(num_hydro_limited))
-
-        logging.info('Calculate minigrid PV LCOE')
-        self.df[SET_LCOE_MG_PV] = self.df.apply(
-            lambda row: mg_pv_calc.get_lcoe(energy_per_hh=row[SET_ENERGY_PER_HH],
-                                            people=row[SET_POP_FUTURE],
-                                            num_people_per_hh=row[SET_NUM_PEOPLE_PER_HH],
-                                            capacity_factor=row[SET_GHI] / HOURS_PER_YEAR)
-            if (row[SET_SOLAR_RESTRICTION] == 1 and row[SET_GHI] > 1000) else 99,
-            axis=1)
-
-        logging.info('Calculate minigrid wind LCOE')
-        self.df[SET_LCOE_MG_WIND] = self.df.apply(
-            lambda row: mg_wind_calc.get_lcoe(energy_per_hh=row[SET_ENERGY_PER_HH],
-                                              people=row[SET_POP_FUTURE], num_people_per_hh=row[SET_NUM_PEOPLE_PER_HH],
-                                              capacity_factor=row[SET_WINDCF])
-            if row[SET_WINDCF] > 0.1 else 99,
-            axis=1)
-
-        logging.info('Calculate minigrid diesel LCOE')
-        self.df[SET_LCOE_MG_DIESEL] = self.df.apply(
-            lambda row:
-            mg_diesel_calc.get_lcoe(energy_per_hh=row[SET_ENERGY_PER_HH],
-                                    people=row[SET_POP_FUTURE],
-                                    num_people_per_hh=row[SET_NUM_PEOPLE_PER_HH],
-                                    travel_hours=row[SET_TRAVEL_HOURS]),
-            axis=1)
-
-        logging.info('Calculate standalone diesel LCOE')
-        self.df[SET_LCOE_SA_DIESEL] = self.df.apply(
-            lambda row:
-            sa_diesel_calc.get_lcoe(energy_per_hh=row[SET_ENERGY_PER_HH],
-                                    people=row[SET_POP_FUTURE],
-                                    num_people_per_hh=row[SET_NUM_PEOPLE_PER_HH],
-                                    travel_hours=row[SET_TRAVEL_HOURS]),
-            axis=1)
-
-        logging.info('Calculate standalone PV LCOE')
-        self.df[SET_LCOE_SA_PV] = self.df.apply(
-            lambda row: sa_pv_calc.get_lcoe(energy_per_hh=row[SET_ENERGY_PER_HH],
-                                            people=row[SET_POP_FUTURE],
-                                            num_people_per_hh=row[SET_NUM_PEOPLE_PER_HH],
-                                            capacity_factor=row[SET_GHI] / HOURS_PER_YEAR)
-            if row[SET_GHI] > 1000 else 99,
-            axis=1)
+                result = self.get_lcoe_results(calc, mask, **self.get_tech_inputs(tech))
+            self.lcoes[:, i] = result.lcoe
+
+            lower = (min_offgrid_tech < 0) | (self.lcoes[:, i] < self.lcoes[np.arange(len(self.df)),
+                                                                            np.maximum(min_offgrid_tech, 0)])
+            min_offgrid_tech[lower] = i
+            min_offgrid_calculated[lower] = mask[lower]
+            for full, part in zip(min_offgrid_result, result):
+                full[lower] = part[lower]
+
+        self.min_offgrid_results = (min_offgrid_tech, min_offgrid_calculated, min_offgrid_result)
 
         logging.info('Determine minimum technology (no grid)')
-        self.df[SET_MIN_OFFGRID] = self.df[[SET_LCOE_SA_DIESEL, SET_LCOE_SA_PV, SET_LCOE_MG_WIND,
-                                            SET_LCOE_MG_DIESEL, SET_LCOE_MG_PV, SET_LCOE_MG_HYDRO]].T.idxmin()
+        offgrid = np.array([tech.category != 'Grid' for tech in TECHNOLOGIES])
+        offgrid_lcoes = self.lcoes[:, offgrid]
+        min_offgrid = np.argmin(offgrid_lcoes, axis=1)
+        self.df[SET_MIN_OFFGRID] = np.array([tech.name for tech in TECHNOLOGIES], dtype=object)[offgrid][min_offgrid]
 
         logging.info('Determine minimum tech LCOE')
-        self.df[SET_MIN_OFFGRID_LCOE] = self.df.apply(lambda row: (row[row[SET_MIN_OFFGRID]]), axis=1)
+        self.df[SET_MIN_OFFGRID_LCOE] = np.take_along_axis(offgrid_lcoes, min_offgrid[:, None], axis=1)[:, 0]
+
+        self.compact_columns()
 
     def results_columns(self, mg_hydro_calc, mg_wind_calc, mg_pv_calc, sa_pv_calc,
-                        mg_diesel_calc, sa_diesel_calc, grid_calc):
+                        mg_diesel_calc, sa_diesel_calc, grid_calc, **other_calcs):
         """
         Once the grid extension algorithm has been run, determine the minimum overall option, and calculate the
         capacity and investment requirements for each settlement
         """
 
-        def res_investment_cost(row):
-            min_tech = row[SET_MIN_OVERALL]
-            if min_tech == SET_LCOE_SA_DIESEL:
-                return sa_diesel_calc.get_lcoe(energy_per_hh=row[SET_ENERGY_PER_HH],
-                                               people=row[SET_POP_FUTURE],
-                                               num_people_per_hh=row[SET_NUM_PEOPLE_PER_HH],
-                                               travel_hours=row[SET_TRAVEL_HOURS],
-                                               get_investment_cost=True)
-            elif min_tech == SET_LCOE_SA_PV:
-                return sa_pv_calc.get_lcoe(energy_per_hh=row[SET_ENERGY_PER_HH],
-                                           people=row[SET_POP_FUTURE],
-                                           num_people_per_hh=row[SET_NUM_PEOPLE_PER_HH],
-                                           capacity_factor=row[SET_GHI] / HOURS_PER_YEAR,
-                                           get_investment_cost=True)
-            elif min_tech == SET_LCOE_MG_WIND:
-                return mg_wind_calc.get_lcoe(energy_per_hh=row[SET_ENERGY_PER_HH],
-                                             people=row[SET_POP_FUTURE],
-                                             num_people_per_hh=row[SET_NUM_PEOPLE_PER_HH],
-                                             capacity_factor=row[SET_WINDCF],
-                                             get_investment_cost=True)
-            elif min_tech == SET_LCOE_MG_DIESEL:
-                return mg_diesel_calc.get_lcoe(energy_per_hh=row[SET_ENERGY_PER_HH],
-                                               people=row[SET_POP_FUTURE],
-                                               num_people_per_hh=row[SET_NUM_PEOPLE_PER_HH],
-                                               travel_hours=row[SET_TRAVEL_HOURS],
-                                               get_investment_cost=True)
-            elif min_tech == SET_LCOE_MG_PV:
-                return mg_pv_calc.get_lcoe(energy_per_hh=row[SET_ENERGY_PER_HH],
-                                           people=row[SET_POP_FUTURE],
-                                           num_people_per_hh=row[SET_NUM_PEOPLE_PER_HH],
-                                           capacity_factor=row[SET_GHI] / HOURS_PER_YEAR,
-                                           get_investment_cost=True)
-            elif min_tech == SET_LCOE_MG_HYDRO:
-                return mg_hydro_calc.get_lcoe(energy_per_hh=row[SET_ENERGY_PER_HH],
-                                              people=row[SET_POP_FUTURE],
-                                              num_people_per_hh=row[SET_NUM_PEOPLE_PER_HH],
-
-                                              mv_line_length=row[SET_HYDRO_DIST],
-                                              get_investment_cost=True)
-            elif min_tech == SET_LCOE_GRID:
-                return grid_calc.get_lcoe(energy_per_hh=row[SET_ENERGY_PER_HH],
-                                          people=row[SET_POP_FUTURE],
-                                          num_people_per_hh=row[SET_NUM_PEOPLE_PER_HH],
-                                          additional_mv_line_length=row[SET_MIN_GRID_DIST],
-                                          get_investment_cost=True)
-            else:
-                raise ValueError('A technology has not been accounted for in res_investment_cost()')
+        calcs = self.get_calcs(mg_hydro_calc, mg_wind_calc, mg_pv_calc, sa_pv_calc, mg_diesel_calc, sa_diesel_calc,
+                               grid_calc, **other_calcs)
 
         logging.info('Determine minimum overall')
-        self.df[SET_MIN_OVERALL] = self.df[[SET_LCOE_GRID, SET_LCOE_SA_DIESEL, SET_LCOE_SA_PV, SET_LCOE_MG_WIND,
-                                            SET_LCOE_MG_DIESEL, SET_LCOE_MG_PV, SET_LCOE_MG_HYDRO]].T.idxmin()
+        for i, tech in enumerate(TECHNOLOGIES):
+            if tech.category == 'Grid':
+                self.lcoes[:, i] = self.df[tech.name]
+        min_overall_index = np.argmin(self.lcoes, axis=1)
+        self.df[SET_MIN_OVERALL] = np.array([tech.name for tech in TECHNOLOGIES], dtype=object)[min_overall_index]
 
         logging.info('Determine minimum overall LCOE')
-        self.df[SET_MIN_OVERALL_LCOE] = self.df.apply(lambda row: (row[row[SET_MIN_OVERALL]]), axis=1)
+        self.df[SET_MIN_OVERALL_LCOE] = np.take_along_axis(self.lcoes, min_overall_index[:, None], axis=1)[:, 0]
 
         logging.info('Add technology codes')
-        codes = {SET_LCOE_GRID: 1, SET_LCOE_MG_HYDRO: 7, SET_LCOE_MG_WIND: 6, SET_LCOE_MG_PV: 5,
-                 SET_LCOE_MG_DIESEL: 4, SET_LCOE_SA_DIESEL: 2, SET_LCOE_SA_PV: 3}
-        self.df.loc[self.df[SET_MIN_OVERALL] == SET_LCOE_GRID, SET_MIN_OVERALL_CODE] = codes[SET_LCOE_GRID]
-        self.df.loc[self.df[SET_MIN_OVERALL] == SET_LCOE_MG_HYDRO, SET_MIN_OVERALL_CODE] = codes[SET_LCOE_MG_HYDRO]
-        self.df.loc[self.df[SET_MIN_OVERALL] == SET_LCOE_SA_PV, SET_MIN_OVERALL_CODE] = codes[SET_LCOE_SA_PV]
-        self.df.loc[self.df[SET_MIN_OVERALL] == SET_LCOE_MG_WIND, SET_MIN_OVERALL_CODE] = codes[SET_LCOE_MG_WIND]
-        self.df.loc[self.df[SET_MIN_OVERALL] == SET_LCOE_MG_PV, SET_MIN_OVERALL_CODE] = codes[SET_LCOE_MG_PV]
-        self.df.loc[self.df[SET_MIN_OVERALL] == SET_LCOE_MG_DIESEL, SET_MIN_OVERALL_CODE] = codes[SET_LCOE_MG_DIESEL]
-        self.df.loc[self.df[SET_MIN_OVERALL] == SET_LCOE_SA_DIESEL, SET_MIN_OVERALL_CODE] = codes[SET_LCOE_SA_DIESEL]
+        self.df[SET_MIN_OVERALL_CODE] = np.array([tech.code for tech in TECHNOLOGIES], dtype=float)[min_overall_index]
 
         logging.info('Determine minimum category')
-        self.df[SET_MIN_CATEGORY] = self.df[SET_MIN_OVERALL].str.extract('(SA|MG|Grid)', expand=False)
-
-        logging.info('Calculate new capacity')
-        self.df.loc[self.df[SET_MIN_OVERALL] == SET_LCOE_GRID, SET_NEW_CAPACITY] = (
-            (self.df[SET_NEW_CONNECTIONS] * self.df[SET_ENERGY_PER_HH] / self.df[SET_NUM_PEOPLE_PER_HH]) /
-            (HOURS_PER_YEAR * grid_calc.capacity_factor * grid_calc.base_to_peak_load_ratio))
-        self.df.loc[self.df[SET_MIN_OVERALL] == SET_LCOE_MG_HYDRO, SET_NEW_CAPACITY] = (
-            (self.df[SET_NEW_CONNECTIONS] * self.df[SET_ENERGY_PER_HH] / self.df[SET_NUM_PEOPLE_PER_HH]) /
-            (HOURS_PER_YEAR * mg_hydro_calc.capacity_factor * mg_hydro_calc.base_to_peak_load_ratio))
-        self.df.loc[self.df[SET_MIN_OVERALL] == SET_LCOE_MG_PV, SET_NEW_CAPACITY] = (
-            (self.df[SET_NEW_CONNECTIONS] * self.df[SET_ENERGY_PER_HH] / self.df[SET_NUM_PEOPLE_PER_HH]) /
-            (HOURS_PER_YEAR * (self.df[SET_GHI] / HOURS_PER_YEAR) * mg_pv_calc.base_to_peak_load_ratio))
-        self.df.loc[self.df[SET_MIN_OVERALL] == SET_LCOE_MG_WIND, SET_NEW_CAPACITY] = (
-            (self.df[SET_NEW_CONNECTIONS] * self.df[SET_ENERGY_PER_HH] / self.df[SET_NUM_PEOPLE_PER_HH]) /
-            (HOURS_PER_YEAR * self.df[SET_WINDCF] * mg_wind_calc.base_to_peak_load_ratio))
-        self.df.loc[self.df[SET_MIN_OVERALL] == SET_LCOE_MG_DIESEL, SET_NEW_CAPACITY] = (
-            (self.df[SET_NEW_CONNECTIONS] * self.df[SET_ENERGY_PER_HH] / self.df[SET_NUM_PEOPLE_PER_HH]) /
-            (HOURS_PER_YEAR * mg_diesel_calc.capacity_factor * mg_diesel_calc.base_to_peak_load_ratio))
-        self.df.loc[self.df[SET_MIN_OVERALL] == SET_LCOE_SA_DIESEL, SET_NEW_CAPACITY] = (
-            (self.df[SET_NEW_CONNECTIONS] * self.df[SET_ENERGY_PER_HH] / self.df[SET_NUM_PEOPLE_PER_HH]) /
-            (HOURS_PER_YEAR * sa_diesel_calc.capacity_factor * sa_diesel_calc.base_to_peak_load_ratio))
-        self.df.loc[self.df[SET_MIN_OVERALL] == SET_LCOE_SA_PV, SET_NEW_CAPACITY] = (
-            (self.df[SET_NEW_CONNECTIONS] * self.df[SET_ENERGY_PER_HH] / self.df[SET_NUM_PEOPLE_PER_HH]) /
-            (HOURS_PER_YEAR * (self.df[SET_GHI] / HOURS_PER_YEAR) * sa_pv_calc.base_to_peak_load_ratio))
-
-        logging.info('Calculate investment cost')
-        self.df[SET_INVESTMENT_COST] = self.df.apply(res_investment_cost, axis=1)
+        self.df[SET_MIN_CATEGORY] = np.array([tech.category for tech in TECHNOLOGIES],
+                                             dtype=object)[min_overall_index]
+
+        # The results of the minimum off-grid technology are kept from calculate_off_grid_lcoes, only the grid (which
+        # depends on the distance found in the extension algorithm) and any settlements not calculated there need a new
+        # calculation
+        logging.info('Calculate new capacity and investment cost')
+        new_capacity = np.zeros(len(self.df))
+        min_overall = LcoeResult(*[np.zeros(len(self.df)) for _ in LcoeResult._fields])
+        min_offgrid_tech, min_offgrid_calculated, min_offgrid_result = self.min_offgrid_results
+        for i, tech in enumerate(TECHNOLOGIES):
+            calc = calcs[tech.name]
+            is_min = min_overall_index == i
+
+            capacity_factor = tech.capacity_factor(self.df) if tech.capacity_factor else calc.capacity_factor
+            new_capacity[is_min] = ((self.df[SET_NEW_CONNECTIONS] * self.df[SET_ENERGY_PER_HH] /
+                                     self.df[SET_NUM_PEOPLE_PER_HH]) /
+                                    (HOURS_PER_YEAR * capacity_factor * calc.base_to_peak_load_ratio))[is_min]
+
+            kept = is_min & (min_offgrid_tech == i) & min_offgrid_calculated
+            missing = is_min & ~kept
+            if missing.any():
+                missing_result = self.get_lcoe_results(calc, missing, **self.get_tech_inputs(tech))
+                for full, part in zip(min_overall, missing_result):
+                    full[missing] = part[missing]
+            for full, part in zip(min_overall, min_offgrid_result):
+                full[kept] = part[kept]
+
+        self.df[SET_NEW_CAPACITY] = new_capacity
+        self.min_overall_results = min_overall
+        self.df[SET_INVESTMENT_COST] = min_overall.investment_cost
+
+        if self.sensitivities:
+            self.grid_sensitivities(calcs, min_overall_index)
+
+        logging.info('Add the LCOE columns')
+        for i, tech in enumerate(TECHNOLOGIES):
+            if tech.category != 'Grid':
+                self.df[tech.name] = self.lcoes[:, i]
+
+        self.compact_columns()
+
+    def grid_sensitivities(self, calcs, min_overall_index):
+        """
+        Adds the grid columns to lcoe_sensitivities, and the sensitivity columns of the minimum overall technology.
+
+        Settlements electrified by 2030 anyway pay the grid price, so only that sensitivity applies to them. For those
+        reached by the grid extension, the grid LCOE is found in the grid table at the (penalty adjusted) MinGridDist,
+        rounded down to the whole km unless the table interpolates, so the derivatives are taken at the same distance.
+        """
+
+        logging.info('Calculate grid sensitivities')
+        for i, tech in enumerate(TECHNOLOGIES):
+            if tech.category != 'Grid':
+                continue
+            pre_electrified = (self.df[SET_ELEC_FUTURE] == 1).values & (self.lcoes[:, i] < 99)
+            extended = ~pre_electrified & (self.lcoes[:, i] < 99)
+            dist = self.df[SET_MIN_GRID_DIST].values.astype(float)
+            if not self.grid_interpolate:
+                dist = np.floor(dist)
+            _, derivatives = self.get_lcoe_results(calcs[tech.name], extended, sensitivities=True,
+                                                   additional_mv_line_length=dist)
+            for field, full, part in zip(LcoeSensitivities._fields, self.lcoe_sensitivities, derivatives):
+                full[:, i] = part
+                if field == 'grid_price':
+                    full[pre_electrified, i] = 1
+
+        logging.info('Add the sensitivity columns')
+        columns = [SET_SENS_DIESEL_PRICE, SET_SENS_CAPITAL_COST, SET_SENS_DISCOUNT_RATE, SET_SENS_GRID_PRICE,
+                   SET_SENS_ENERGY_PER_HH]
+        for column, derivatives in zip(columns, self.lcoe_sensitivities):
+            self.df[column] = np.take_along_axis(derivatives, min_overall_index[:, None], axis=1)[:, 0]
+
+    def calculate_break_even_prices(self, diesel_price, grid_price):
+        """
+        Finds, for each settlement, the diesel price and the grid price nearest to the current ones at which the
+        minimum overall technology changes, and the technology it changes to. Run after results_columns, with the
+        diesel and grid price used for the scenario.
+
+        The LCOE of every technology is linear in both prices (through the fuel cost), with the slopes found by the
+        sensitivities, so the break-even price is where the line of the current minimum first crosses another one.
+        The grid extension is held as found by run_elec, so the grid is only considered where it reached the
+        settlement (a grid LCOE below 99). Where no change happens at a price of zero or more, the price is left empty.
+        """
+
+        if self.lcoe_sensitivities is None:
+            raise ValueError('Break-even prices need the LCOE sensitivities, '
+                             'create the SettlementProcessor with sensitivities=True')
+
+        logging.info('Calculate break-even diesel and grid prices')
+        self.df[SET_BREAK_EVEN_DIESEL_PRICE], self.df[SET_BREAK_EVEN_DIESEL_TECH] = self.get_break_even(
+            self.lcoe_sensitivities.diesel_price, diesel_price)
+        self.df[SET_BREAK_EVEN_GRID_PRICE], self.df[SET_BREAK_EVEN_GRID_TECH] = self.get_break_even(
+            self.lcoe_sensitivities.grid_price, self.get_grid_prices(grid_price))
+
+        self.compact_columns()
+
+    def get_break_even(self, slopes, price):
+        """
+        With slopes the derivatives of lcoes with respect to a price (settlements x technologies), returns the price
+        nearest to the current one (a scalar, or one per settlement) where the minimum overall technology changes, and
+        the name of the new technology.
+        """
+
+        lcoes = self.lcoes.astype(np.float64)
+        price = np.broadcast_to(np.asarray(price, dtype=float), (len(lcoes),))[:, None]
+        min_index = np.argmin(lcoes, axis=1)[:, None]
+        min_lcoe = np.take_along_axis(lcoes, min_index, axis=1)
+        min_slope = np.take_along_axis(slopes, min_index, axis=1)
+
+        # Each line crosses the current minimum at price + change, the first crossing in either direction is where
+        # the minimum changes (technologies at 99 aren't an option)
+        slope_difference = min_slope - slopes
+        crossing = (lcoes < 99) & (slope_difference != 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            change = np.where(crossing, (lcoes - min_lcoe) / slope_difference, np.inf)
+        change[(price + change < 0) | (np.arange(lcoes.shape[1]) == min_index)] = np.inf
+
+        nearest = np.argmin(np.abs(change), axis=1)
+        nearest_change = change[np.arange(len(change)), nearest]
+        found = np.isfinite(nearest_change)
+
+        break_even_price = np.where(found, price[:, 0] + nearest_change, np.nan)
+        break_even_tech = np.where(found, np.array([tech.name for tech in TECHNOLOGIES], dtype=object)[nearest], None)
+        return break_even_price, break_even_tech
 
     def calc_summaries(self):
         """
@@ -1159,8 +2971,7 @@ class SettlementProcessor:
 
         logging.info('Calculate summaries')
         rows = []
-        techs = [SET_LCOE_GRID, SET_LCOE_SA_DIESEL, SET_LCOE_SA_PV, SET_LCOE_MG_WIND,
-                 SET_LCOE_MG_DIESEL, SET_LCOE_MG_PV, SET_LCOE_MG_HYDRO]
+        techs = [tech.name for tech in TECHNOLOGIES]
         rows.extend([population_ + t for t in techs])
         rows.extend([new_connections_ + t for t in techs])
         rows.extend([capacity_ + t for t in techs])
@@ -21,6 +21,10 @@ countries = specs.index.tolist() if 'all' in countries else countries
 
 choice = int(input('1 to prep, 2 to run a scenario: '))
 
+# Parquet and Feather are much faster to read and write than CSV for large countries, and keep the dtypes. A store
+# is a directory of memory-mapped columns, and the scenario results then only add their new columns to it
+file_format = str(input('Settlement file format (csv, parquet, feather or store): ')).strip().lower() or 'csv'
+
 if choice == 0:
     settlements_csv = str(input('Enter the name of the file containing all countries: '))
     base_dir = str(input('Enter the base file directory to save the split countries: '))
@@ -32,11 +36,12 @@ if choice == 0:
     except FileExistsError:
         pass
 
-    df = pd.read_csv(settlements_csv)
+    df = read_settlements(settlements_csv)
 
     for country in countries:
         print(country)
-        df.loc[df[SET_COUNTRY] == country].to_csv(os.path.join(base_dir, '{}.csv'.format(country)), index=False)
+        write_settlements(df.loc[df[SET_COUNTRY] == country],
+                          os.path.join(base_dir, '{}.{}'.format(country, file_format)))
 
 elif choice == 1:
     base_dir = str(input('Enter the base file directory containing separated countries (files will be overwritten): '))
@@ -44,7 +49,7 @@ elif choice == 1:
 
     for country in countries:
         print(country)
-        settlements_in_csv = os.path.join(base_dir, '{}.csv'.format(country))
+        settlements_in_csv = os.path.join(base_dir, '{}.{}'.format(country, file_format))
 
         onsseter = SettlementProcessor(settlements_in_csv)
 
@@ -82,7 +87,7 @@ elif choice == 1:
         specs.loc[country, SPE_URBAN_CUTOFF] = urban_cutoff
 
         specs.to_excel(specs_path)
-        onsseter.df.to_csv(settlements_in_csv, index=False)
+        write_settlements(onsseter.df, settlements_in_csv)
 
 elif choice == 2:
     base_dir = str(input('Enter the base file directory containing separated and prepped countries: '))
@@ -102,6 +107,14 @@ elif choice == 2:
     diesel_high = True if 'y' in input('Use high diesel value? <y/n> ') else False
     diesel_tag = 'high' if diesel_high else 'low'
 
+    sensitivities = True if 'y' in input('Add LCOE sensitivity and break-even price columns? <y/n> ') else False
+    interpolate = True if 'y' in input('Interpolate grid LCOEs from coarser tables? <y/n> ') else False
+    continuous_demand = True if 'y' in input('Use grid LCOE tables over continuous demand (always used with an '
+                                             'EnergyPerPerson layer)? <y/n> ') else False
+    compact = True if 'y' in input('Keep settlements in compact dtypes (for large countries)? <y/n> ') else False
+    deduplicate = True if 'y' in input('Calculate LCOEs once per combination of inputs rounded to 0.1% (for large '
+                                       'countries)? <y/n> ') else False
+
     # Uncomment row below if running multiple countries/regions
     do_combine = False
     # do_combine = True if 'y' in input('Combine countries into a single file? <y/n> ') else False
@@ -113,15 +126,29 @@ elif choice == 2:
     except FileExistsError:
         pass
 
-    for country in countries:
+    # Grid tables are reused across countries and runs with the same grid parameters and demand
+    grid_table_cache = GridTableCache(os.path.join(output_dir, 'grid_table_cache'))
+
+    # The next country is read and the results of the last one are written in background threads while a country
+    # runs, with at most pipeline_depth countries waiting to be run and to be written (each holding its settlements)
+    pipeline_depth = 1
+
+    def read_country(country):
+        return SettlementProcessor(os.path.join(base_dir, '{}.{}'.format(country, file_format)),
+                                   sensitivities=sensitivities, deduplicate=deduplicate,
+                                   quantization=DEDUP_QUANTIZATION if deduplicate else None, columns=SCENARIO_COLUMNS,
+                                   compact=compact)
+
+    writer = BackgroundWriter(depth=pipeline_depth)
+
+    for country, onsseter in prefetch(read_country, countries, depth=pipeline_depth):
         # create country_specs here
         print(' --- {} --- {} --- {} --- '.format(country, wb_tier_urban, diesel_tag))
-        settlements_in_csv = os.path.join(base_dir, '{}.csv'.format(country))
-        settlements_out_csv = os.path.join(output_dir, '{}_{}_{}_{}.csv'.format(country, wb_tier_urban, wb_tier_rural, diesel_tag))
+        settlements_in_csv = os.path.join(base_dir, '{}.{}'.format(country, file_format))
+        settlements_out_csv = os.path.join(output_dir, '{}_{}_{}_{}.{}'.format(country, wb_tier_urban, wb_tier_rural,
+                                                                               diesel_tag, file_format))
         summary_csv = os.path.join(output_dir, '{}_{}_{}_{}_summary.csv'.format(country, wb_tier_urban, wb_tier_rural, diesel_tag))
 
-        onsseter = SettlementProcessor(settlements_in_csv)
-
         diesel_price = specs[SPE_DIESEL_PRICE_HIGH][country] if diesel_high else specs[SPE_DIESEL_PRICE_LOW][country]
         grid_price = specs[SPE_GRID_PRICE][country]
         existing_grid_cost_ratio = specs[SPE_EXISTING_GRID_COST_RATIO][country]
@@ -131,21 +158,22 @@ elif choice == 2:
         energy_per_hh_rural = wb_tiers_all[wb_tier_rural] * num_people_per_hh_rural
         energy_per_hh_urban = wb_tiers_all[wb_tier_urban] * num_people_per_hh_urban
 
-        Technology.set_default_values(start_year=2015,
-                                      end_year=2030,
-                                      discount_rate=0.08,
-                                      grid_cell_area=1,
-                                      mv_line_cost=9000,
-                                      lv_line_cost=5000,
-                                      mv_line_capacity=50,
-                                      lv_line_capacity=10,
-                                      lv_line_max_length=30,
-                                      hv_line_cost=53000,
-                                      mv_line_max_length=50,
-                                      hv_lv_transformer_cost=5000,
-                                      mv_increase_rate=0.1)
-
-        grid_calc = Technology(om_of_td_lines=0.03,
+        config = TechnologyConfig(start_year=2015,
+                                  end_year=2030,
+                                  discount_rate=0.08,
+                                  grid_cell_area=1,
+                                  mv_line_cost=9000,
+                                  lv_line_cost=5000,
+                                  mv_line_capacity=50,
+                                  lv_line_capacity=10,
+                                  lv_line_max_length=30,
+                                  hv_line_cost=53000,
+                                  mv_line_max_length=50,
+                                  hv_lv_transformer_cost=5000,
+                                  mv_increase_rate=0.1)
+
+        grid_calc = Technology(config=config,
+                               om_of_td_lines=0.03,
                                distribution_losses=float(specs[SPE_GRID_LOSSES][country]),
                                connection_cost_per_hh=125,
                                base_to_peak_load_ratio=float(specs[SPE_BASE_TO_PEAK][country]),
@@ -154,7 +182,8 @@ elif choice == 2:
                                grid_capacity_investment=float(specs[SPE_GRID_CAPACITY_INVESTMENT][country]),
                                grid_price=grid_price)
 
-        mg_hydro_calc = Technology(om_of_td_lines=0.03,
+        mg_hydro_calc = Technology(config=config,
+                                   om_of_td_lines=0.03,
                                    distribution_losses=0.05,
                                    connection_cost_per_hh=100,
                                    base_to_peak_load_ratio=1,
@@ -163,7 +192,8 @@ elif choice == 2:
                                    capital_cost=5000,
                                    om_costs=0.02)
 
-        mg_wind_calc = Technology(om_of_td_lines=0.03,
+        mg_wind_calc = Technology(config=config,
+                                  om_of_td_lines=0.03,
                                   distribution_losses=0.05,
                                   connection_cost_per_hh=100,
                                   base_to_peak_load_ratio=0.75,
@@ -171,7 +201,8 @@ elif choice == 2:
                                   om_costs=0.02,
                                   tech_life=20)
 
-        mg_pv_calc = Technology(om_of_td_lines=0.03,
+        mg_pv_calc = Technology(config=config,
+                                om_of_td_lines=0.03,
                                 distribution_losses=0.05,
                                 connection_cost_per_hh=100,
                                 base_to_peak_load_ratio=0.9,
@@ -179,13 +210,15 @@ elif choice == 2:
                                 om_costs=0.015,
                                 capital_cost=4300)
 
-        sa_pv_calc = Technology(base_to_peak_load_ratio=0.9,
+        sa_pv_calc = Technology(config=config,
+                                base_to_peak_load_ratio=0.9,
                                 tech_life=15,
                                 om_costs=0.012,
                                 capital_cost=5500,
                                 standalone=True)
 
-        mg_diesel_calc = Technology(om_of_td_lines=0.03,
+        mg_diesel_calc = Technology(config=config,
+                                    om_of_td_lines=0.03,
                                     distribution_losses=0.05,
                                     connection_cost_per_hh=100,
                                     base_to_peak_load_ratio=0.5,
@@ -198,7 +231,8 @@ elif choice == 2:
                                     diesel_truck_consumption=33.7,
                                     diesel_truck_volume=15000)
 
-        sa_diesel_calc = Technology(base_to_peak_load_ratio=0.5,
+        sa_diesel_calc = Technology(config=config,
+                                    base_to_peak_load_ratio=0.5,
                                     capacity_factor=0.7,
                                     tech_life=10,
                                     om_costs=0.1,
@@ -215,12 +249,22 @@ elif choice == 2:
         onsseter.calculate_off_grid_lcoes(mg_hydro_calc, mg_wind_calc, mg_pv_calc,
                                           sa_pv_calc, mg_diesel_calc, sa_diesel_calc)
 
-        grid_lcoes_rural = grid_calc.get_grid_table(energy_per_hh_rural, num_people_per_hh_rural,
-                                                    max_grid_extension_dist)
-        grid_lcoes_urban = grid_calc.get_grid_table(energy_per_hh_urban, num_people_per_hh_urban,
-                                                    max_grid_extension_dist)
-        onsseter.run_elec(grid_lcoes_rural, grid_lcoes_urban, grid_price,
-                          existing_grid_cost_ratio, max_grid_extension_dist)
+        # The grid tables only cover the population bins of the country's unelectrified settlements. The continuous
+        # demand tables don't depend on the tiers, so the cached ones are reused for every tier (with bins added where
+        # the country's demand goes beyond them)
+        people, is_urban = onsseter.get_grid_table_settlements()
+        if continuous_demand or SET_ENERGY_PER_PERSON in onsseter.df:
+            energies = DemandGridLcoeTable.get_energies(onsseter.df[SET_ENERGY_PER_HH])
+            grid_lcoes = DemandGridLcoeTable.from_technology(grid_calc, num_people_per_hh_rural,
+                                                             num_people_per_hh_urban, max_grid_extension_dist,
+                                                             energies=energies, cache=grid_table_cache, people=people,
+                                                             is_urban=is_urban)
+        else:
+            grid_lcoes = GridLcoeTable.from_technology(grid_calc, energy_per_hh_rural, num_people_per_hh_rural,
+                                                       energy_per_hh_urban, num_people_per_hh_urban,
+                                                       max_grid_extension_dist, cache=grid_table_cache,
+                                                       interpolate=interpolate, people=people, is_urban=is_urban)
+        onsseter.run_elec(grid_lcoes, grid_price, existing_grid_cost_ratio, max_grid_extension_dist)
 
         #onsseter.calc_grid_extension_cost(grid_calc, max_grid_extension_dist)
         #onsseter.run_elec(grid_price, existing_grid_cost_ratio, max_grid_extension_dist, grid_calc)
@@ -229,6 +273,13 @@ elif choice == 2:
         onsseter.results_columns(mg_hydro_calc, mg_wind_calc, mg_pv_calc, sa_pv_calc,
                                  mg_diesel_calc, sa_diesel_calc, grid_calc)
 
+        if sensitivities:
+            onsseter.calculate_break_even_prices(diesel_price, grid_price)
+
+        logging.info('{}: LCOE dedup ratio {:.2f}'.format(country, onsseter.get_dedup_ratio()))
+        logging.info('Grid table cache: {} hits, {} misses so far'.format(grid_table_cache.hits,
+                                                                          grid_table_cache.misses))
+
         summary = onsseter.calc_summaries()
         summary.name = country
 
@@ -239,13 +290,16 @@ elif choice == 2:
                 summary.to_csv(summary_csv, header=True)
             else:
                 pass
-        try:
-            onsseter.df.to_csv(settlements_out_csv, index=False)
-        except PermissionError:
-            if 'y' in input('Output csv file open. Close it and enter "y" to overwrite (or rename the open file first)'):
-                onsseter.df.to_csv(settlements_out_csv, index=False)
-            else:
-                pass
+        writer.submit(write_settlements, onsseter.df, settlements_out_csv, base=settlements_in_csv)
+
+    for write, args, kwargs, error in writer.close():
+        if not isinstance(error, PermissionError):
+            raise error
+        if 'y' in input('Output file {} open. Close it and enter "y" to overwrite (or rename the open file '
+                        'first)'.format(args[1])):
+            write(*args, **kwargs)
+        else:
+            pass
 
     if do_combine:
         print('\n --- Combining --- \n')
@@ -254,7 +308,8 @@ elif choice == 2:
 
         for country in countries:
             print(country)
-            df_add = pd.read_csv(os.path.join(output_dir, '{}_{}_{}.csv'.format(country, wb_tier_urban, diesel_tag)))
+            df_add = read_settlements(os.path.join(output_dir, '{}_{}_{}.{}'.format(country, wb_tier_urban, diesel_tag,
+                                                                                     file_format)))
             df_base = df_base.append(df_add, ignore_index=True)
 
             summaries[country] = pd.read_csv(os.path.join(output_dir, '{}_{}_{}_summary.csv'.format(country,
@@ -263,7 +318,8 @@ elif choice == 2:
                                              squeeze=True, index_col=0)
 
         print('saving csv')
-        df_base.to_csv(os.path.join(output_dir, '{}_{}_{}.csv'.format(wb_tier_urban, wb_tier_rural, diesel_tag)), index=False)
+        write_settlements(df_base, os.path.join(output_dir, '{}_{}_{}.{}'.format(wb_tier_urban, wb_tier_rural,
+                                                                                diesel_tag, file_format)))
         summaries.to_csv(os.path.join(output_dir, '{}_{}_{}_summary.csv'.format(wb_tier_urban, wb_tier_rural, diesel_tag)))
 
     logging.info('Scenario run finished')
\ No newline at end of file